@@ -0,0 +1,60 @@
+"""API write throughput with password in every request and with api token (Authorization: Bearer).
+
+Comments are added through POST /api/comments by the flask test client on a temporary database.
+
+run from the project folder:
+    python -m benchmarks.api_auth --requests 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+def run(client, requests, news_id, user_id, password=None, token=None):
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    data = {'text': 'comment', 'news_id': news_id, 'creator_id': user_id}
+    if password:
+        data['creator_password'] = password
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.post('/api/comments', json=data, headers=headers)
+        assert response.status_code == 200, response.json
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--requests', type=int, default=200)
+    args = arg_parser.parse_args()
+
+    from server import create_app
+    from modules import db_session
+    from modules.news import News
+    from modules.user import User
+
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app({'DB_FILE': os.path.join(folder, 'bench.db'), 'DB_MIGRATE': True})
+
+        session = db_session.create_session()
+        user = User(nickname='bench', email='bench@example.com')
+        user.set_password('password')
+        session.add(user)
+        session.commit()
+        news = News(title='bench', about='bench', creator_id=user.id)
+        session.add(news)
+        session.commit()
+        user_id, news_id = user.id, news.id
+        session.close()
+
+        client = app.test_client()
+        token = client.post('/api/tokens', json={'email': 'bench@example.com', 'password': 'password'}).json['token']
+
+        for name, kwargs in (('password', {'password': 'password'}), ('token', {'token': token})):
+            seconds = run(client, args.requests, news_id, user_id, **kwargs)
+            print(f'{name:>10}: {args.requests / seconds:8.1f} writes/s {seconds / args.requests * 1000:7.2f} ms/write')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Latency (p50/p95/p99) and requests per second of pages and api on a database made by benchmarks.seed.
+
+In process through the flask test client, one request at a time:
+    python -m benchmarks.seed /tmp/bench.db
+    python -m benchmarks.load /tmp/bench.db --requests 200 --output results.json
+
+With concurrent http clients against a running server on the same database:
+    DB_FILE=/tmp/bench.db python server.py
+    python -m benchmarks.load /tmp/bench.db --url http://127.0.0.1:5000 --concurrency 8 --output results.json
+
+Compare with saved results (exit code is 1 if p95 of some scenario is more than 20% worse):
+    python -m benchmarks.load /tmp/bench.db --baseline baseline.json --max-regression 20
+
+Pages are requested by logged in users (anonymous ones get pages from page cache, see main_page_anonymous).
+Write scenarios add comments, news and users, seed the database again before runs you want to compare exactly.
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.seed import SEED_PASSWORD
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+# items in one batch request
+BATCH_SIZE = 10
+
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, **kwargs):
+        response = self.client.open(path, method=method, **kwargs)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpClient:
+    def __init__(self, url):
+        import requests
+
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, self.url + path, allow_redirects=False, **kwargs)
+        return response.status_code, response.text
+
+
+class Worker:
+    # one simulated user: logged in client, anonymous client and api token
+    def __init__(self, make_client, user_id, email):
+        self.user_id = user_id
+        self.email = email
+        self.client = make_client()
+        self.anonymous = make_client()
+
+        _, page = self.client.request('GET', '/login')
+        match = CSRF_TOKEN.search(page)
+        # forms of the same client session take the same token
+        self.csrf_token = match.group(1) if match else None
+        self.login()
+        _, answer = self.client.request('POST', '/api/tokens', json=self.credentials())
+        self.api_headers = {'Authorization': f'Bearer {json.loads(answer)["token"]}'}
+
+    def credentials(self):
+        return {'email': self.email, 'password': SEED_PASSWORD}
+
+    def form(self, **fields):
+        return dict(fields, csrf_token=self.csrf_token) if self.csrf_token else fields
+
+    def login(self):
+        return self.client.request('POST', '/login', data=self.form(**self.credentials()))
+
+
+def news_item(rnd, data):
+    return {'title': 'benchmark', 'about': 'benchmark news', 'tags': f'#{rnd.choice(data["tags"])}'}
+
+
+# name: (anonymous, function (worker, data, rnd) -> (method, path, request kwargs))
+SCENARIOS = {
+    'main_page': (False, lambda w, d, r: ('GET', '/', {})),
+    'main_page_anonymous': (True, lambda w, d, r: ('GET', '/', {})),
+    'news_show': (False, lambda w, d, r: ('GET', f'/news/{r.choice(d["news"])}', {})),
+    'tag_search': (False, lambda w, d, r: ('GET', f'/news/search/{r.choice(d["tags"])}', {})),
+    'text_search': (False, lambda w, d, r: ('GET', '/news/find?q=lorem', {})),
+    'profile': (False, lambda w, d, r: ('GET', f'/user/profile/{r.choice(d["users"])[0]}', {})),
+    'login': (False, lambda w, d, r: ('POST', '/login', {'data': w.form(**w.credentials())})),
+    'comment_post': (False, lambda w, d, r: ('POST', f'/news/{r.choice(d["news"])}',
+                                             {'data': w.form(text='benchmark comment')})),
+
+    'api_token': (True, lambda w, d, r: ('POST', '/api/tokens', {'json': w.credentials()})),
+    'api_news_list': (True, lambda w, d, r: ('GET', '/api/news?limit=20', {})),
+    'api_news_search': (True, lambda w, d, r: ('GET', '/api/news?q=lorem&limit=20', {})),
+    'api_news_item': (True, lambda w, d, r: ('GET', f'/api/news/{r.choice(d["news"])}', {})),
+    'api_news_post': (True, lambda w, d, r: ('POST', '/api/news', {
+        'json': dict(news_item(r, d), creator_id=w.user_id), 'headers': w.api_headers})),
+    'api_news_batch': (True, lambda w, d, r: ('POST', '/api/news/batch', {
+        'json': {'creator_id': w.user_id, 'news': [news_item(r, d) for _ in range(BATCH_SIZE)]},
+        'headers': w.api_headers})),
+    'api_comments_list': (True, lambda w, d, r: ('GET', f'/api/comments?limit=20&news_id={r.choice(d["news"])}',
+                                                 {})),
+    'api_comment_item': (True, lambda w, d, r: ('GET', f'/api/comments/{r.choice(d["comments"])}', {})),
+    'api_comment_post': (True, lambda w, d, r: ('POST', '/api/comments', {
+        'json': {'text': 'benchmark comment', 'news_id': r.choice(d['news']), 'creator_id': w.user_id},
+        'headers': w.api_headers})),
+    'api_comments_batch': (True, lambda w, d, r: ('POST', '/api/comments/batch', {
+        'json': {'creator_id': w.user_id, 'comments': [{'text': 'benchmark comment', 'news_id': r.choice(d['news'])}
+                                                       for _ in range(BATCH_SIZE)]},
+        'headers': w.api_headers})),
+    'api_users_list': (True, lambda w, d, r: ('GET', '/api/users?limit=20', {})),
+    'api_user_item': (True, lambda w, d, r: ('GET', f'/api/users/{r.choice(d["users"])[0]}', {})),
+    'api_users_batch': (True, lambda w, d, r: ('POST', '/api/users/batch', {'json': {'users': [
+        {'nickname': 'benchmark', 'email': f'{uuid.uuid4().hex}@example.com', 'password': SEED_PASSWORD}]}})),
+}
+
+
+def load_data(database):
+    # ids the requests are made with
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    data = {
+        'users': conn.execute('SELECT id, email FROM users WHERE id != 1 AND email IS NOT NULL').fetchall(),
+        'news': [i for i, in conn.execute('SELECT id FROM news')],
+        'comments': [i for i, in conn.execute('SELECT id FROM comments')],
+        'tags': [i for i, in conn.execute('SELECT name FROM tags')],
+    }
+    conn.close()
+    if not all(data.values()):
+        sys.exit(f'{database} has no users, news, comments or tags, fill it with benchmarks.seed first')
+    return data
+
+
+def percentile(values, percent):
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1] if len(values) > 1 else values[0]
+
+
+def run_scenario(workers, name, data, requests, warmup, random_seed):
+    anonymous, make_request = SCENARIOS[name]
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def work(number, count):
+        worker = workers[number]
+        client = worker.anonymous if anonymous else worker.client
+        rnd = random.Random(f'{random_seed}-{name}-{number}')
+        worker_latencies = []
+        for _ in range(count):
+            method, path, kwargs = make_request(worker, data, rnd)
+            start = time.perf_counter()
+            status, _ = client.request(method, path, **kwargs)
+            worker_latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                with lock:
+                    errors.append(f'{method} {path}: {status}')
+        return worker_latencies
+
+    # requests are split between workers
+    counts = [requests // len(workers) + (number < requests % len(workers)) for number in range(len(workers))]
+    for number in range(len(workers)):
+        work(number, warmup)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+        for worker_latencies in executor.map(work, range(len(workers)), counts):
+            latencies += worker_latencies
+    seconds = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'rps': round(len(latencies) / seconds, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def compare(results, baseline, max_regression):
+    # prints changes against baseline, returns names of scenarios with p95 worse than max_regression percents
+    regressions = []
+    for key in ('mode', 'concurrency', 'database'):
+        if results[key] != baseline.get(key):
+            print(f'warning: {key} differs from baseline: {baseline.get(key)} -> {results[key]}')
+    print(f'\n{"compared with baseline":<24}{"p95 ms":>22}{"rps":>22}')
+    for name, result in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        change = (result['p95_ms'] / old['p95_ms'] - 1) * 100 if old['p95_ms'] else 0
+        mark = ''
+        if change > max_regression:
+            regressions.append(name)
+            mark = '  REGRESSION'
+        print(f'{name:<24}{old["p95_ms"]:>9.2f} ->{result["p95_ms"]:>8.2f} ({change:+4.0f}%)'
+              f'{old["rps"]:>10.1f} ->{result["rps"]:>8.1f}{mark}')
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('database', help='database made by benchmarks.seed')
+    arg_parser.add_argument('--url', help='url of running server, without it requests go through the test client')
+    arg_parser.add_argument('--concurrency', type=int, default=1, help='simulated users making requests at once')
+    arg_parser.add_argument('--requests', type=int, default=200, help='measured requests of every scenario')
+    arg_parser.add_argument('--warmup', type=int, default=5, help='not measured requests of every worker')
+    arg_parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'comma separated, all by default: {", ".join(SCENARIOS)}')
+    arg_parser.add_argument('--random-seed', type=int, default=1)
+    arg_parser.add_argument('--output', help='json file for results')
+    arg_parser.add_argument('--baseline', help='json file of previous results to compare with')
+    arg_parser.add_argument('--max-regression', type=float, default=20, help='percents of p95 growth to fail')
+    args = arg_parser.parse_args()
+
+    names = [i.strip() for i in args.scenarios.split(',') if i.strip()]
+    unknown = [i for i in names if i not in SCENARIOS]
+    if unknown:
+        arg_parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    if args.url:
+        def make_client():
+            return HttpClient(args.url)
+    else:
+        if args.concurrency != 1:
+            arg_parser.error('test client runs one request at a time, use --url for concurrent load')
+        from server import create_app
+
+        app = create_app({'DB_FILE': args.database})
+
+        def make_client():
+            return TestClient(app)
+
+    data = load_data(args.database)
+    rnd = random.Random(args.random_seed)
+    workers = [Worker(make_client, *user) for user in rnd.sample(data['users'], args.concurrency)]
+
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'mode': 'http' if args.url else 'test client',
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'python': platform.python_version(),
+        'database': {key: len(value) for key, value in data.items()},
+        'scenarios': {}
+    }
+    print(f'{"scenario":<24}{"rps":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    for name in names:
+        result = run_scenario(workers, name, data, args.requests, args.warmup, args.random_seed)
+        results['scenarios'][name] = result
+        print(f'{name:<24}{result["rps"]:>9.1f}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+              f'{result["p99_ms"]:>9.2f}{result["errors"]:>8}' + (f'  {result["first_error"]}' if result['errors']
+                                                                   else ''))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            sys.exit(f'p95 is more than {args.max_regression:g}% worse in: {", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Time of requests with and without metrics (METRICS_ENABLED) on a temporary seeded database.
+
+Runs with metrics on and off alternate, so both get the same state of caches and database,
+the best round of each is shown.
+
+run from the project folder:
+    python -m benchmarks.metrics_overhead --requests 200 --rounds 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+PATHS = ('/api/news/1', '/api/news?limit=20', '/api/comments?limit=20', '/news/1', '/user/profile/2', '/')
+
+
+def run(client, path, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--requests', type=int, default=200, help='requests of every path in one round')
+    arg_parser.add_argument('--rounds', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    from server import create_app
+    from modules import db_session, page_cache
+    from benchmarks.seed import seed
+
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app({'DB_FILE': os.path.join(folder, 'bench.db'), 'DB_MIGRATE': True})
+        with app.app_context():
+            seed(db_session.create_session(), random.Random(1), users=50, news=1000, comments=10000, tags=20,
+                 images=0, max_image_size=app.config['MAX_IMAGE_SIZE'])
+        # pages of anonymous users would come from page cache
+        page_cache.cache.max_bytes = 0
+        client = app.test_client()
+
+        print(f'{"path":<26}{"off, us":>10}{"on, us":>10}{"diff, us":>10}{"overhead":>10}')
+        for path in PATHS:
+            times = {False: [], True: []}
+            for _ in range(args.rounds):
+                for enabled in (False, True):
+                    app.config['METRICS_ENABLED'] = enabled
+                    times[enabled].append(run(client, path, args.requests))
+            off, on = min(times[False]) * 1e6, min(times[True]) * 1e6
+            print(f'{path:<26}{off:>10.1f}{on:>10.1f}{on - off:>10.1f}{(on / off - 1) * 100:>9.1f}%')
+
+
+if __name__ == '__main__':
+    main()
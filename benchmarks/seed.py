@@ -0,0 +1,133 @@
+"""Fill a new sqlite database with synthetic users, news, comments, tags and placeholder images.
+
+All users have password "password" and emails user<N>@example.com. Same --random-seed gives same data,
+so benchmark runs on such databases can be compared. Placeholder images are stored as usual blobs
+in static/img/blobs, so run it from the project folder:
+    python -m benchmarks.seed /tmp/bench.db --users 200 --news 5000 --comments 50000 --tags 100 --images 20
+
+then run the server on it with DB_FILE=/tmp/bench.db or pass it to benchmarks.load
+"""
+import argparse
+import datetime
+import io
+import os
+import random
+import time
+
+import sqlalchemy as sa
+
+SEED_PASSWORD = 'password'
+# news and comments are spread over DAYS before END_DATE (fixed, so same seed gives same database)
+END_DATE = datetime.datetime(2024, 1, 1)
+DAYS = 365
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et '
+         'dolore magna aliqua').split()
+
+
+def user_email(number):
+    return f'user{number}@example.com'
+
+
+def text(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+
+def dates(rnd, count):
+    # sorted random dates of last DAYS days, so ids go in order of dates like in real database
+    return sorted(END_DATE - datetime.timedelta(seconds=rnd.randrange(DAYS * 24 * 60 * 60)) for _ in range(count))
+
+
+def placeholder_images(session, count, max_size):
+    # blob ids of count different png images
+    from PIL import Image
+    from werkzeug.datastructures import FileStorage
+    from modules.blob import store_image
+
+    blob_ids = []
+    for number in range(count):
+        data = io.BytesIO()
+        Image.new('RGB', (640, 480), ((number * 47) % 256, (number * 89) % 256, (number * 139) % 256)) \
+            .save(data, 'PNG')
+        data.seek(0)
+        blob_ids.append(store_image(session, FileStorage(data, filename=f'placeholder{number}.png'), max_size))
+    session.commit()
+    return blob_ids
+
+
+def seed(session, rnd, users, news, comments, tags, images, max_image_size):
+    from modules.user import User
+    from modules.news import News
+    from modules.comment import Comment, recount_comments
+    from modules.tag import Tag, news_tags
+    from modules.blob import Blob
+
+    # password hash is slow on purpose, so it is made once for everybody
+    hashed = User()
+    hashed.set_password(SEED_PASSWORD)
+    first_user = (session.query(sa.func.max(User.id)).scalar() or 1) + 1
+    session.execute(sa.insert(User), [
+        {'nickname': f'user {number}', 'email': user_email(number), 'about': text(rnd, 10),
+         'hashed_password': hashed.hashed_password, 'image': 'no_pfp.png'}
+        for number in range(first_user, first_user + users)])
+    user_ids = list(range(first_user, first_user + users))
+
+    blob_ids = placeholder_images(session, images, max_image_size)
+    tag_names = [f'tag{number}' for number in range(tags)]
+    if tag_names:
+        session.execute(sa.insert(Tag).prefix_with('OR IGNORE'), [{'name': name} for name in tag_names])
+    tag_ids = dict(session.query(Tag.name, Tag.id).filter(Tag.name.in_(tag_names)))
+
+    first_news = (session.query(sa.func.max(News.id)).scalar() or 0) + 1
+    news_rows, links, image_refs = [], [], {}
+    for number, date in enumerate(dates(rnd, news)):
+        news_tag_names = sorted(rnd.sample(tag_names, min(len(tag_names), rnd.randint(0, 3))))
+        news_images = rnd.sample(blob_ids, min(len(blob_ids), rnd.randint(0, 2)))
+        for blob_id in news_images:
+            image_refs[blob_id] = image_refs.get(blob_id, 0) + 1
+        news_rows.append({'id': first_news + number, 'title': text(rnd, 5), 'about': text(rnd, 60),
+                          'images': ';'.join(news_images), 'tags': ';'.join(news_tag_names),
+                          'creation_date': date, 'updated_at': date, 'creator_id': rnd.choice(user_ids)})
+        links += [{'tag_id': tag_ids[name], 'news_id': first_news + number} for name in news_tag_names]
+    session.execute(sa.insert(News), news_rows)
+    if links:
+        session.execute(news_tags.insert(), links)
+    # every news image is one more reference to the blob
+    for blob_id, refs in image_refs.items():
+        session.query(Blob).filter(Blob.id == blob_id).update({Blob.ref_count: Blob.ref_count + refs})
+
+    news_ids = [row['id'] for row in news_rows]
+    if news_ids:
+        session.execute(sa.insert(Comment), [
+            {'text': text(rnd, 15), 'creator_id': rnd.choice(user_ids), 'news_id': rnd.choice(news_ids),
+             'creation_date': date, 'updated_at': date, 'is_edited': False}
+            for date in dates(rnd, comments)])
+    # commits
+    recount_comments(session)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('database', help='sqlite file, it is created if there is no such file')
+    arg_parser.add_argument('--users', type=int, default=200)
+    arg_parser.add_argument('--news', type=int, default=5000)
+    arg_parser.add_argument('--comments', type=int, default=50000)
+    arg_parser.add_argument('--tags', type=int, default=100)
+    arg_parser.add_argument('--images', type=int, default=20)
+    arg_parser.add_argument('--random-seed', type=int, default=1)
+    args = arg_parser.parse_args()
+
+    from server import create_app
+    from modules import db_session
+
+    start = time.perf_counter()
+    app = create_app({'DB_FILE': os.path.abspath(args.database), 'DB_MIGRATE': True})
+    with app.app_context():
+        session = db_session.create_session()
+        seed(session, random.Random(args.random_seed), args.users, args.news, args.comments, args.tags,
+             args.images, app.config['MAX_IMAGE_SIZE'])
+    print(f'{args.users} users, {args.news} news, {args.comments} comments, {args.tags} tags, {args.images} images '
+          f'in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Mixed read/write throughput of sqlite with default pragmas and with the production profile.
+
+Readers load main page feed, writers add comments, both work at the same time for some seconds.
+
+run from the project folder:
+    python -m benchmarks.sqlite_profile --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import sqlalchemy as sa
+
+from modules import db_session
+from modules.db_session import SqlAlchemyBase, make_engine
+
+
+def seed(engine, news_count):
+    from modules import __all_models
+
+    SqlAlchemyBase.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.text("INSERT INTO users (id, nickname, image) VALUES (1, 'user', 'no_pfp.png')"))
+        conn.execute(sa.text("INSERT INTO news (title, about, images, tags, creation_date, creator_id) "
+                             "VALUES (:title, :about, '', '', :date, 1)"),
+                     [{'title': f'news {i}', 'about': 'text ' * 50, 'date': f'2023-01-01 00:00:{i % 60:02}.{i:06}'}
+                      for i in range(news_count)])
+
+
+def run(engine, read_engine, readers, writers, seconds, news_count):
+    counters = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def reader():
+        while time.perf_counter() < stop:
+            with read_engine.connect() as conn:
+                conn.execute(sa.text('SELECT * FROM news ORDER BY creation_date DESC, id DESC LIMIT 32')).all()
+            with lock:
+                counters['reads'] += 1
+
+    def writer():
+        while time.perf_counter() < stop:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(sa.text("INSERT INTO comments (text, creator_id, news_id, creation_date, is_edited) "
+                                         "VALUES ('comment', 1, :news_id, '2023-01-01 00:00:00', 0)"),
+                                 {'news_id': random.randint(1, news_count)})
+                key = 'writes'
+            except sa.exc.OperationalError:
+                # "database is locked"
+                key = 'errors'
+            with lock:
+                counters[key] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)] + \
+              [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {key: value / seconds for key, value in counters.items()}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--readers', type=int, default=8)
+    arg_parser.add_argument('--writers', type=int, default=2)
+    arg_parser.add_argument('--seconds', type=float, default=5)
+    arg_parser.add_argument('--news', type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    pool = {'pool_size': args.readers + args.writers, 'max_overflow': 0}
+    for name in ('default', 'production'):
+        pragmas = db_session.sqlite_pragmas(name)
+        with tempfile.TemporaryDirectory() as folder:
+            db_file = os.path.join(folder, 'bench.db')
+            engine = make_engine(db_file, pragmas, **pool)
+            seed(engine, args.news)
+            # production profile reads through its own read only pool like the server does
+            read_engine = make_engine(db_file, pragmas, read_only=True, **pool) if name == 'production' else engine
+
+            result = run(engine, read_engine, args.readers, args.writers, args.seconds, args.news)
+            print(f'{name:>10}: {result["reads"]:9.1f} reads/s {result["writes"]:9.1f} writes/s '
+                  f'{result["errors"]:7.1f} "database is locked"/s')
+            engine.dispose()
+            read_engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
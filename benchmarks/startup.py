@@ -0,0 +1,78 @@
+"""Start time of a server process: import of server.py (python -X importtime) and create_app.
+
+Every run is a new python process on the database, the first one only warms up disk cache and .pyc files.
+Median times are shown with import time of the packages server.py pulls in (their own code, without
+packages imported by them), so a new heavy import at module level is easy to see:
+    flask --app server init-db
+    python -m benchmarks.startup db/data.db --runs 10 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+CODE = '''
+import time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.create_app()
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+def parse_importtime(stderr):
+    # microseconds of own code of every top level package imported by "import server"
+    lines = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        lines.append((int(self_us), name[1:]))
+    # children are printed before their parent, the ones of server go after the previous top level import
+    end = next(number for number, (_, name) in enumerate(lines) if name == 'server')
+    start = end
+    while start > 0 and lines[start - 1][1].startswith(' '):
+        start -= 1
+    packages = {}
+    for self_us, name in lines[start:end + 1]:
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return packages
+
+
+def run(database):
+    env = dict(os.environ, DB_FILE=os.path.abspath(database))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CODE], env=env, capture_output=True,
+                            text=True)
+    if result.returncode:
+        sys.exit(result.stderr.strip().splitlines()[-1])
+    import_seconds, app_seconds = map(float, result.stdout.strip().splitlines()[-1].split())
+    return import_seconds, app_seconds, parse_importtime(result.stderr)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('database', help='database with applied migrations')
+    arg_parser.add_argument('--runs', type=int, default=10)
+    arg_parser.add_argument('--top', type=int, default=15, help='packages with the longest import to show')
+    args = arg_parser.parse_args()
+
+    run(args.database)
+    runs = [run(args.database) for _ in range(args.runs)]
+
+    import_ms = statistics.median(i[0] for i in runs) * 1000
+    app_ms = statistics.median(i[1] for i in runs) * 1000
+    print(f'import server: {import_ms:8.1f} ms')
+    print(f'create_app:    {app_ms:8.1f} ms')
+    print(f'total:         {import_ms + app_ms:8.1f} ms\n')
+
+    packages = {name: statistics.median(i[2].get(name, 0) for i in runs) / 1000 for name in runs[0][2]}
+    print(f'{"package":<28}{"import ms":>10}')
+    for name, ms in sorted(packages.items(), key=lambda i: -i[1])[:args.top]:
+        print(f'{name:<28}{ms:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Peak memory (RSS) of saving one big uploaded image: old writelines(readlines()) and streamed save_image.
+
+Every way runs in its own process, so peaks don't mix.
+
+run from the project folder:
+    python -m benchmarks.upload_memory --size 20
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from werkzeug.datastructures import FileStorage
+
+from modules.uploads import save_image
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+
+
+def save_old(file, path):
+    with open(path, mode='wb') as f:
+        f.writelines(file.readlines())
+
+
+def save_new(file, path):
+    save_image(file, path, 1024 * 1024 * 1024)
+
+
+def child(way, source):
+    # werkzeug keeps big uploads in temporary file, so we give a file stream too
+    with open(source, 'rb') as stream, tempfile.TemporaryDirectory() as folder:
+        before = rss_mb()
+        {'old': save_old, 'new': save_new}[way](FileStorage(stream, 'image.jpg'), os.path.join(folder, 'image.jpg'))
+        print(f'{way:>4}: peak rss {max_rss_mb():7.1f} MB (+{max_rss_mb() - before:.1f} MB while saving)')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--size', type=int, default=20, help='size of the image in MB')
+    arg_parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.child:
+        return child(*args.child)
+
+    with tempfile.NamedTemporaryFile(suffix='.jpg') as source:
+        # jpeg header and random bytes, they have a lot of "\n" like real compressed images
+        # (written by pieces, peak memory of this process is inherited by children)
+        source.write(b'\xff\xd8\xff\xe0')
+        for _ in range(args.size):
+            source.write(os.urandom(1024 * 1024))
+        source.flush()
+        for way in ('old', 'new'):
+            subprocess.run([sys.executable, '-m', 'benchmarks.upload_memory', '--child', way, source.name], check=True)
+
+
+if __name__ == '__main__':
+    main()
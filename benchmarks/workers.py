@@ -0,0 +1,90 @@
+"""Requests per second and latency of one gunicorn process against several worker processes (see wsgi.py).
+
+Starts gunicorn on the database made by benchmarks.seed once for every --workers value (each worker has
+--threads threads), makes --concurrency simulated users send the requests of every scenario and stops it:
+    pip install gunicorn
+    python -m benchmarks.seed /tmp/bench.db
+    python -m benchmarks.workers /tmp/bench.db --workers 1,4 --threads 4 --concurrency 8 --requests 1000
+
+Python threads of one process take turns on the GIL, so pages that are rendered (not served from cache)
+get faster with processes. Every worker has its own page cache and its own database pools.
+Only read scenarios by default, so runs on the same database can be compared.
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.load import HttpClient, Worker, load_data, run_scenario
+
+SCENARIOS = ('main_page', 'main_page_anonymous', 'news_show', 'api_news_list', 'api_news_item')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database, workers, threads, port, timeout=60):
+    env = dict(os.environ, DB_FILE=os.path.abspath(database))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+                                '-b', f'127.0.0.1:{port}', '--preload', 'wsgi:app'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    client = HttpClient(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'gunicorn exited with code {process.returncode}, is it installed?')
+        try:
+            client.request('GET', '/api/news?limit=1')
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f'gunicorn did not start in {timeout} s')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('database', help='database made by benchmarks.seed')
+    arg_parser.add_argument('--workers', default='1,4', help='worker processes of every run, comma separated')
+    arg_parser.add_argument('--threads', type=int, default=4, help='threads of every worker')
+    arg_parser.add_argument('--concurrency', type=int, default=8, help='simulated users making requests at once')
+    arg_parser.add_argument('--requests', type=int, default=1000, help='measured requests of every scenario')
+    arg_parser.add_argument('--warmup', type=int, default=5, help='not measured requests of every user')
+    arg_parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, see benchmarks.load')
+    arg_parser.add_argument('--random-seed', type=int, default=1)
+    args = arg_parser.parse_args()
+
+    names = [i.strip() for i in args.scenarios.split(',') if i.strip()]
+    data = load_data(args.database)
+    results = {}
+    for workers in [int(i) for i in args.workers.split(',')]:
+        process, url = start_server(args.database, workers, args.threads, free_port())
+        try:
+            rnd = random.Random(args.random_seed)
+            users = [Worker(lambda: HttpClient(url), *user) for user in rnd.sample(data['users'], args.concurrency)]
+            results[workers] = {name: run_scenario(users, name, data, args.requests, args.warmup, args.random_seed)
+                                for name in names}
+        finally:
+            process.terminate()
+            process.wait()
+
+    columns = list(results)
+    print(f'{"scenario":<24}' + ''.join(f'{f"{i}w rps":>10}{f"{i}w p95":>10}' for i in columns))
+    for name in names:
+        print(f'{name:<24}' + ''.join(f'{results[i][name]["rps"]:>10.1f}{results[i][name]["p95_ms"]:>10.2f}'
+                                      for i in columns))
+    for workers in columns:
+        errors = [f'{name}: {result["first_error"]}' for name, result in results[workers].items() if result['errors']]
+        if errors:
+            print(f'{workers} workers errors: ' + '; '.join(errors))
+
+
+if __name__ == '__main__':
+    main()
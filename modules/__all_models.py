@@ -1,3 +1,7 @@
 from . import news
 from . import user
-from . import comment
\ No newline at end of file
+from . import comment
+from . import tag
+from . import blob
+from . import versions
+from . import migrations
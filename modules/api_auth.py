@@ -0,0 +1,56 @@
+import hashlib
+
+from flask import current_app, request
+from flask_restful import abort
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from werkzeug.security import check_password_hash
+
+# Password hashes are slow on purpose, so api clients exchange the password for a signed token once
+# (POST /api/tokens) and then send "Authorization: Bearer <token>" with every request.
+# The token has user id and a fingerprint of the password hash, so it stops working when password is changed
+
+
+def __serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='api-token')
+
+
+def password_fingerprint(user):
+    return hashlib.sha256(user.hashed_password.encode()).hexdigest()[:16]
+
+
+def make_token(user):
+    return __serializer().dumps({'id': user.id, 'pw': password_fingerprint(user)})
+
+
+def bearer_token():
+    # token from "Authorization: Bearer <token>" header or None
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def token_payload():
+    # payload of the request token, None if there is no token. Wrong or expired token is 401 error
+    token = bearer_token()
+    if token is None:
+        return None
+    try:
+        return __serializer().loads(token, max_age=current_app.config['API_TOKEN_MAX_AGE'])
+    except SignatureExpired:
+        abort(401, message='API token expired, get a new one at /api/tokens')
+    except BadSignature:
+        abort(401, message='API token is not valid')
+
+
+def is_authorized(user, password):
+    """Check that request is made by the user.
+
+    with a token in Authorization header only the token is checked, otherwise the password is
+    """
+    payload = token_payload()
+    if payload is not None:
+        return user.hashed_password is not None and payload.get('id') == user.id and \
+            payload.get('pw') == password_fingerprint(user)
+    return password is not None and user.hashed_password is not None and \
+        check_password_hash(user.hashed_password, password)
@@ -0,0 +1,45 @@
+from flask_restful import abort
+
+from .api_auth import is_authorized
+from .user import User
+
+# Batch endpoints (POST and DELETE /api/<news|comments>/batch, POST /api/users/batch) do many operations
+# in one transaction with one auth check and answer with result for every item:
+#   {"success": "OK", "results": [{"index": 0, "id": 12}, {"index": 1, "error": "..."}]}
+
+# items in one request
+MAX_BATCH_SIZE = 10000
+# users in one POST /api/users/batch, it needs no auth and every password hash takes about 0.1 s of cpu
+MAX_USER_BATCH_SIZE = 100
+
+
+def check_batch_size(items, max_size=MAX_BATCH_SIZE):
+    if len(items) > max_size:
+        abort(400, message=f"too many items ({len(items)}), max is {max_size} in one request")
+
+
+def parse_ids(values):
+    check_batch_size(values)
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in values):
+        abort(400, message="ids should be a list of integers")
+    return values
+
+
+def batch_user(session, user_id, password):
+    # user who makes the request, checked once for the whole batch
+    user = session.query(User).get(user_id)
+    if user is None:
+        abort(404, message=f'User with id {user_id} not found')
+    if user.id == 1 or not is_authorized(user, password):
+        abort(405, message="user api token or password doesn't match with sent one")
+    return user
+
+
+def text_error(item, keys):
+    # error of one item with required text fields or None
+    if not isinstance(item, dict):
+        return 'item should be an object'
+    for key in keys:
+        if not isinstance(item.get(key), str) or item[key] == '':
+            return f'"{key}" should be not empty string'
+    return None
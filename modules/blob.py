@@ -0,0 +1,187 @@
+import datetime
+import hashlib
+import os
+import uuid
+
+import sqlalchemy
+from flask import current_app
+from sqlalchemy.orm import Session
+
+from .db_session import SqlAlchemyBase
+from .images import BLOB_FOLDER, blob_path, is_blob_id, make_variants_async, remove_image, variant_path, \
+    VARIANT_FORMATS, VARIANT_WIDTHS
+from .uploads import CHUNK_SIZE, save_image, detect_image_type
+
+
+class Blob(SqlAlchemyBase):
+    # stored image, id is "<sha256 of content>.<real type>", so same images are stored only once
+    __tablename__ = 'blobs'
+
+    id = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+
+    size = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+
+    # how many news images and users pictures use this blob, file is deleted when nobody uses it
+    ref_count = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
+
+    creation_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
+
+
+def blob_file(blob_id):
+    # static folder of the app, not of the working directory (gunicorn can be started from anywhere)
+    return os.path.join(current_app.static_folder, blob_path(blob_id))
+
+
+def has_variants(path):
+    # the last downsized copy is written last
+    return os.path.exists(variant_path(path, VARIANT_WIDTHS[-1], 'webp'))
+
+
+def add_ref(session, blob_id, size):
+    # returns True if blob is new
+    blob = session.query(Blob).get(blob_id)
+    if blob is None:
+        try:
+            with session.begin_nested():
+                session.add(Blob(id=blob_id, size=size, ref_count=1))
+            return True
+        except sqlalchemy.exc.IntegrityError:
+            # the same image was added by other request at the same time, its row is used
+            blob = session.query(Blob).get(blob_id)
+    blob.ref_count += 1
+    return False
+
+
+def store_image(session, file, max_size):
+    """Save uploaded image in blobs folder (if there is no such image yet) and count one more reference to it.
+
+    returns blob id, raises UploadError for wrong files
+    """
+    tmp_folder = os.path.join(current_app.static_folder, BLOB_FOLDER, 'tmp')
+    os.makedirs(tmp_folder, exist_ok=True)
+    tmp_path = os.path.join(tmp_folder, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    ext = save_image(file, tmp_path, max_size, digest=digest)
+    blob_id = f'{digest.hexdigest()}.{ext}'
+    path = blob_file(blob_id)
+
+    # the reference is flushed (it takes the write lock) before the file is put,
+    # so the file can't be removed by remove_unused_files of a release committed at the same time
+    try:
+        add_ref(session, blob_id, os.path.getsize(tmp_path))
+        session.flush()
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # same content if the file is already here
+    os.replace(tmp_path, path)
+
+    if not has_variants(path):
+        make_variants_async(path)
+    return blob_id
+
+
+def release_blob(session, blob_id):
+    # one reference less, if nobody uses the image anymore its row is deleted and its file is removed
+    # when the session commits (rolled back session keeps the file)
+    if not is_blob_id(blob_id):
+        return
+    blob = session.query(Blob).get(blob_id)
+    if blob is None:
+        return
+    blob.ref_count -= 1
+    if blob.ref_count <= 0:
+        session.delete(blob)
+        # path is known now, after commit there can be no app context
+        session.info.setdefault('released_blobs', {})[blob_id] = blob_file(blob_id)
+
+
+def remove_unused_files(engine, blob_files):
+    # files of blobs that have no row. The write lock is held while they are removed, so store_image of the same
+    # image either has flushed its reference already (the row is seen here) or puts the file again after us
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        for blob_id, path in blob_files.items():
+            if cursor.execute('SELECT 1 FROM blobs WHERE id = ?', (blob_id,)).fetchone() is None:
+                remove_image(path)
+        connection.commit()
+    except engine.dialect.dbapi.OperationalError:
+        # "database is locked", the changes are committed already, only unused files are left
+        connection.rollback()
+    finally:
+        connection.close()
+
+
+@sqlalchemy.event.listens_for(Session, 'after_commit')
+def remove_released(session):
+    blob_files = session.info.pop('released_blobs', None)
+    if blob_files:
+        remove_unused_files(session.get_bind(), blob_files)
+
+
+@sqlalchemy.event.listens_for(Session, 'after_rollback')
+def forget_released(session):
+    session.info.pop('released_blobs', None)
+
+
+def move_to_blobs(session, path):
+    # move old style image file into blobs folder (with its downsized copies), returns blob id or None
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, 'rb') as f:
+        ext = detect_image_type(f.read(16))
+        if ext is None:
+            return None
+        f.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    blob_id = f'{digest.hexdigest()}.{ext}'
+    new_path = blob_file(blob_id)
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+
+    if add_ref(session, blob_id, os.path.getsize(path)):
+        os.replace(path, new_path)
+        # downsized copies are moved too if their format is still right
+        old_formats = {VARIANT_FORMATS.get(path.rsplit('.', 1)[-1].lower()), 'webp'}
+        for fmt in old_formats & {VARIANT_FORMATS[ext], 'webp'}:
+            for width in VARIANT_WIDTHS:
+                if os.path.exists(variant_path(path, width, fmt)):
+                    os.replace(variant_path(path, width, fmt), variant_path(new_path, width, fmt))
+    # same image is already stored, this copy (and what is left of its downsized copies) is not needed
+    remove_image(path)
+    return blob_id
+
+
+def migrate_images(session):
+    # move images from img/news/<news id>/<name> and img/users/<user id>.<ext> to blobs
+    # (downsized copies for images that don't have them can be made with "backfill-images" command)
+    from .news import News
+    from .user import User
+
+    # current_app is needed only if there are such images (new database is migrated without app context)
+    for news in session.query(News).filter(News.images != '', News.images.isnot(None)):
+        images = []
+        for name in news.images.split(';'):
+            blob_id = name if is_blob_id(name) else move_to_blobs(
+                session, os.path.join(current_app.static_folder, 'img/news', str(news.id), name))
+            if blob_id is not None:
+                images.append(blob_id)
+        news.images = ';'.join(images)
+        try:
+            os.rmdir(os.path.join(current_app.static_folder, 'img/news', str(news.id)))
+        except OSError:
+            pass
+
+    for user in session.query(User).filter(User.image.notin_(['no_pfp.png', 'dead_user.png'])):
+        if not is_blob_id(user.image):
+            path = os.path.join(current_app.static_folder, 'img/users', user.image)
+            user.image = move_to_blobs(session, path) or 'no_pfp.png'
+
+    session.commit()
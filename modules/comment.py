@@ -3,6 +3,7 @@ import sqlalchemy
 from sqlalchemy import orm
 from .db_session import SqlAlchemyBase
 from sqlalchemy_serializer import SerializerMixin
+from .news import News
 
 
 class Comment(SqlAlchemyBase, SerializerMixin):
@@ -13,9 +14,40 @@ class Comment(SqlAlchemyBase, SerializerMixin):
     text = sqlalchemy.Column(sqlalchemy.String, nullable=False)
 
     creation_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
+    updated_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
     is_edited = sqlalchemy.Column(sqlalchemy.Boolean, default=False)
 
-    creator_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    # comments are deleted by the database with their user or news (foreign_keys pragma is on).
+    # Models describe the schema after all migrations, indexes of creator_id and news_id are made by migration 2
+    creator_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("users.id", ondelete='CASCADE'),
+                                   nullable=False, index=True)
+    creator = orm.relationship('User')
 
-    news_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("news.id"))
+    news_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("news.id", ondelete='CASCADE'),
+                                index=True)
     news = orm.relationship('News')
+
+
+def update_comment_stats(session, news_ids):
+    # comment_count and last_comment_at of the news are counted again after their comments were added, edited
+    # or deleted. It is one UPDATE in the same transaction, so they can't differ from comments table
+    news_ids = set(news_ids)
+    if not news_ids:
+        return
+    session.query(News).filter(News.id.in_(news_ids)).update({
+        News.comment_count: sqlalchemy.select(sqlalchemy.func.count(Comment.id))
+        .where(Comment.news_id == News.id).scalar_subquery(),
+        News.last_comment_at: sqlalchemy.select(sqlalchemy.func.max(Comment.creation_date))
+        .where(Comment.news_id == News.id).scalar_subquery()
+    }, synchronize_session=False)
+
+
+def recount_comments(session):
+    # comment stats of all news by one aggregate query
+    stats = sqlalchemy.select(News.id.label('news_id'), sqlalchemy.func.count(Comment.id).label('count'),
+                              sqlalchemy.func.max(Comment.creation_date).label('last')) \
+        .outerjoin(Comment, Comment.news_id == News.id).group_by(News.id).subquery()
+    session.execute(sqlalchemy.update(News).where(News.id == stats.c.news_id)
+                    .values(comment_count=stats.c.count, last_comment_at=stats.c.last)
+                    .execution_options(synchronize_session=False))
+    session.commit()
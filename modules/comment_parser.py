@@ -3,5 +3,18 @@ from flask_restful import reqparse
 parser = reqparse.RequestParser()
 parser.add_argument('text', required=True)
 parser.add_argument('creator_id', required=True, type=int)
-parser.add_argument('creator_password', required=True)
+# not needed with api token (see api_auth.py)
+parser.add_argument('creator_password', required=False)
 parser.add_argument('news_id', required=True, type=int)
+
+# many comments of one user in one request: {"creator_id": 2, "comments": [{"news_id": 1, "text": ...}]}
+batch_parser = reqparse.RequestParser()
+batch_parser.add_argument('creator_id', required=True, type=int)
+batch_parser.add_argument('creator_password', required=False)
+batch_parser.add_argument('comments', required=True, type=list, location='json')
+
+# {"creator_id": 2, "ids": [1, 2, 3]}
+batch_delete_parser = reqparse.RequestParser()
+batch_delete_parser.add_argument('creator_id', required=True, type=int)
+batch_delete_parser.add_argument('creator_password', required=False)
+batch_delete_parser.add_argument('ids', required=True, type=list, location='json')
@@ -2,13 +2,25 @@ import datetime
 
 from flask_restful import reqparse, abort, Api, Resource
 from flask import jsonify, request
-from werkzeug.security import check_password_hash
 
 from . import db_session
-from .comment import Comment
+from .comment import Comment, update_comment_stats
 from .news import News
 from .user import User
-from .comment_parser import parser
+from .comment_parser import parser, batch_parser, batch_delete_parser
+from .api_auth import bearer_token, is_authorized
+from .batch import check_batch_size, parse_ids, batch_user, text_error
+from .page_cache import invalidate_on_commit
+from .list_api import parse_fields, parse_since, filter_query, list_response
+from .schema import Schema
+from .versions import table_versions, make_etag, not_modified, with_etag
+
+# fields that api gives for comments and fields that are given by default
+COMMENT_SCHEMA = Schema(Comment, {
+    'id': Comment.id, 'text': Comment.text, 'news.id': News.id, 'news_id': Comment.news_id,
+    'creator_id': Comment.creator_id, 'creation_date': Comment.creation_date, 'is_edited': Comment.is_edited
+}, {'news': (News, Comment.news_id == News.id)})
+COMMENT_DEFAULT_FIELDS = ('id', 'text', 'news.id', 'creator_id')
 
 
 def abort_if_comment_not_found(com_id):
@@ -16,41 +28,50 @@ def abort_if_comment_not_found(com_id):
     com = session.query(Comment).get(com_id)
     if not com:
         abort(404, message=f"Comment with id {com_id} not found")
+    return com
 
 
 class CommentResource(Resource):
     def get(self, com_id):
-        abort_if_comment_not_found(com_id)
-        session = db_session.create_session()
-        com = session.query(Comment).get(com_id)
-        return jsonify({'comment': com.to_dict(
-            only=('id', 'text', 'news.id', 'creator_id'))})
+        session = db_session.create_read_session()
+        # answer has news id, it is null if the news is deleted
+        stamp = session.query(Comment.updated_at, News.id).outerjoin(News, Comment.news_id == News.id) \
+            .filter(Comment.id == com_id).first()
+        if stamp is None:
+            abort(404, message=f"Comment with id {com_id} not found")
+
+        etag = make_etag(*stamp)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        return with_etag(jsonify({'comment': COMMENT_SCHEMA.first(session, COMMENT_DEFAULT_FIELDS,
+                                                                  Comment.id == com_id)}), etag)
 
     def delete(self, com_id):
-        abort_if_comment_not_found(com_id)
+        com = abort_if_comment_not_found(com_id)
 
-        creator_data = request.json
+        creator_data = request.get_json(silent=True) or {}
 
         session = db_session.create_session()
-        com = session.query(Comment).get(com_id)
 
-        if creator_data.get('creator_password') is None:
+        if creator_data.get('creator_password') is None and bearer_token() is None:
             abort(405, message=f'to delete comment by user with id >{com.creator_id}<'
-                               f' send his password in json with "creator_password" key. '
+                               f' send his api token or his password in json with "creator_password" key. '
                                f'Exception at comment with id {com.id}')
 
         creator = session.query(User).get(com.creator_id)
 
-        if not check_password_hash(creator.hashed_password, creator_data['creator_password']):
+        if not is_authorized(creator, creator_data.get('creator_password')):
             return abort(405, message=f"password doesn't match comment creator password, "
                                       f"can't delete comment with id {com.id}")
 
         session.delete(com)
+        update_comment_stats(session, [com.news_id])
         session.commit()
         return jsonify({'success': 'OK'})
 
     def put(self, com_id):
-        abort_if_comment_not_found(com_id)
+        comment = abort_if_comment_not_found(com_id)
 
         # if there's no json error 400 pops and there is no way to control it...
         args = request.json
@@ -59,10 +80,9 @@ class CommentResource(Resource):
 
         session = db_session.create_session()
 
-        comment = session.query(Comment).get(com_id)
-
-        if args['creator_password'] is None:
-            abort(405, message=f"you need user password to change one of his comments. Json key is 'creator_password'. "
+        if args['creator_password'] is None and bearer_token() is None:
+            abort(405, message=f"you need user api token or password to change one of his comments. "
+                               f"Json key is 'creator_password'. "
                                f"Exeption at comment with id {com_id}")
 
         if args['text'] is None:
@@ -71,13 +91,14 @@ class CommentResource(Resource):
 
         creator = session.query(User).get(comment.creator_id)
 
-        if not check_password_hash(creator.hashed_password, args['creator_password']):
+        if not is_authorized(creator, args['creator_password']):
             abort(405, message=f"user password doesn't match with sent one."
                                f"Exception at comment with id {com_id}")
 
         comment.text = args['text']
         comment.creation_date = datetime.datetime.now()
         comment.is_edited = True
+        update_comment_stats(session, [comment.news_id])
 
         session.commit()
         return jsonify({'success': 'OK'})
@@ -85,10 +106,18 @@ class CommentResource(Resource):
 
 class CommentListResource(Resource):
     def get(self):
-        session = db_session.create_session()
-        comms = session.query(Comment).all()
-        return jsonify({'comments': [item.to_dict(
-            only=('id', 'text', 'news.id', 'creator_id')) for item in comms]})
+        session = db_session.create_read_session()
+
+        etag = make_etag(table_versions(session, ('comments', 'news')))
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        fields = parse_fields(tuple(COMMENT_SCHEMA.fields), COMMENT_DEFAULT_FIELDS)
+        query = filter_query(COMMENT_SCHEMA.query(session, fields), {'creator_id': (Comment.creator_id, int),
+                                                                     'news_id': (Comment.news_id, int),
+                                                                     'since': (Comment.creation_date, parse_since)})
+        return with_etag(list_response('comments', COMMENT_SCHEMA, query, fields), etag)
 
     def post(self):
         args = parser.parse_args()
@@ -103,7 +132,7 @@ class CommentListResource(Resource):
         if not user:
             abort(404, message=f'User with id {args["creator_id"]} not found')
 
-        if not check_password_hash(user.hashed_password, args['creator_password']):
+        if not is_authorized(user, args['creator_password']):
             abort(405, message=f"user password doesn't match with sent one. Can't create comment by invalid user")
 
         comment = Comment(
@@ -113,5 +142,61 @@ class CommentListResource(Resource):
         news.comments.append(comment)
 
         session.add(comment)
+        update_comment_stats(session, [news.id])
         session.commit()
         return jsonify({'success': 'OK'})
+
+
+class CommentBatchResource(Resource):
+    def post(self):
+        args = batch_parser.parse_args()
+        check_batch_size(args['comments'])
+        session = db_session.create_session()
+        user = batch_user(session, args['creator_id'], args['creator_password'])
+
+        news_ids = {item.get('news_id') for item in args['comments']
+                    if isinstance(item, dict) and isinstance(item.get('news_id'), int)}
+        found = {row.id for row in session.query(News.id).filter(News.id.in_(news_ids))}
+
+        results, created = [], []
+        for index, item in enumerate(args['comments']):
+            error = text_error(item, ('text',))
+            if error is None and (not isinstance(item.get('news_id'), int) or item['news_id'] not in found):
+                error = f'News with id {item.get("news_id")} not found'
+            if error is not None:
+                results.append({'index': index, 'error': error})
+                continue
+            created.append((index, Comment(text=item['text'], creator_id=user.id, news_id=item['news_id'])))
+
+        # all comments are inserted by one flush
+        session.add_all([comment for _, comment in created])
+        session.flush()
+        results += [{'index': index, 'id': comment.id} for index, comment in created]
+        update_comment_stats(session, [comment.news_id for _, comment in created])
+        session.commit()
+        return jsonify({'success': 'OK', 'results': sorted(results, key=lambda x: x['index'])})
+
+    def delete(self):
+        args = batch_delete_parser.parse_args()
+        ids = parse_ids(args['ids'])
+        session = db_session.create_session()
+        user = batch_user(session, args['creator_id'], args['creator_password'])
+
+        found = {row.id: row for row in
+                 session.query(Comment.id, Comment.creator_id, Comment.news_id).filter(Comment.id.in_(ids))}
+        results, deleted = [], []
+        for index, com_id in enumerate(ids):
+            if com_id not in found:
+                results.append({'index': index, 'id': com_id, 'error': f'Comment with id {com_id} not found'})
+            elif found[com_id].creator_id != user.id:
+                results.append({'index': index, 'id': com_id, 'error': 'comment belongs to another user'})
+            else:
+                results.append({'index': index, 'id': com_id})
+                deleted.append(com_id)
+
+        if deleted:
+            session.query(Comment).filter(Comment.id.in_(deleted)).delete(synchronize_session=False)
+            update_comment_stats(session, [found[i].news_id for i in deleted])
+            invalidate_on_commit(session, {f'comments:{found[i].news_id}' for i in deleted})
+        session.commit()
+        return jsonify({'success': 'OK', 'results': results})
@@ -1,15 +1,86 @@
+import os
+
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
 import sqlalchemy.ext.declarative as dec
+from flask import g, has_app_context
 
 SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
+# sessions for read only requests, they use their own connections (see create_read_session)
+__read_factory = None
 
+# connection pool counters (see pool_stats)
+__pool_counters = {'connects': 0, 'checkouts': 0, 'checkins': 0, 'overflows': 0}
 
-def global_init(db_file):
-    global __factory
+# pragmas that are set on every new sqlite connection
+SQLITE_PROFILES = {
+    # sqlite defaults
+    'default': {},
+    'production': {
+        # readers don't wait for writer and writer doesn't wait for readers
+        'journal_mode': 'WAL',
+        # with WAL it is still safe (no corruption), only last transactions can be lost on power loss
+        'synchronous': 'NORMAL',
+        # milliseconds to wait for the write lock instead of failing with "database is locked"
+        'busy_timeout': 5000,
+        # page cache of every connection, negative value is in KiB (64 MiB)
+        'cache_size': -65536,
+        # read database file through memory map (256 MiB)
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY'
+    }
+}
+
+
+def sqlite_pragmas(profile='production', overrides=''):
+    # overrides look like "busy_timeout=10000,cache_size=-2000"
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for item in overrides.split(','):
+        if item.strip():
+            key, value = item.split('=')
+            pragmas[key.strip()] = value.strip()
+    return pragmas
+
+
+def make_engine(db_file, pragmas=None, read_only=False, pool_size=5, max_overflow=10, pool_recycle=-1,
+                pool_timeout=30):
+    if read_only:
+        conn_str = f'sqlite:///file:{db_file}?mode=ro&uri=true&check_same_thread=False'
+    else:
+        conn_str = f'sqlite:///{db_file}?check_same_thread=False'
+
+    engine = sa.create_engine(conn_str, echo=False, poolclass=sa.pool.QueuePool, pool_size=pool_size,
+                              max_overflow=max_overflow, pool_recycle=pool_recycle, pool_timeout=pool_timeout)
+
+    # ON DELETE CASCADE / SET NULL of the models work only with this pragma
+    pragmas = dict({'foreign_keys': 'ON'}, **(pragmas or {}))
+    if read_only:
+        # journal mode is stored in database file, it is set by the writing engine
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 1
+
+    @sa.event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f'PRAGMA {key}={value}')
+        cursor.close()
+
+    return engine
+
+
+def global_init(db_file, pragmas=None, read_pool_size=0, query_checker=None, **pool_kwargs):
+    """Connect to the database, its schema is not changed (see apply_migrations and check_schema).
+
+    pragmas - sqlite pragmas for every connection (see SQLITE_PROFILES)
+    read_pool_size - if not 0, read only sessions get their own pool of this size
+    query_checker - query_check.QueryChecker that watches statements of requests (development mode)
+    pool_kwargs - pool_size, max_overflow, pool_recycle and pool_timeout of the main pool
+    """
+    global __factory, __read_factory
 
     if __factory:
         return
@@ -17,18 +88,106 @@ def global_init(db_file):
     if not db_file or not db_file.strip():
         raise Exception("Необходимо указать файл базы данных.")
 
-    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
-    print(f"Подключение к базе данных по адресу {conn_str}")
+    print(f"Подключение к базе данных по адресу {db_file.strip()}")
 
-    engine = sa.create_engine(conn_str, echo=False)
+    engine = make_engine(db_file.strip(), pragmas, **pool_kwargs)
+    __listen_pool(engine)
     __factory = orm.sessionmaker(bind=engine)
 
     from . import __all_models
+    if query_checker is not None:
+        query_checker.listen(engine)
+
+    if read_pool_size:
+        read_engine = make_engine(db_file.strip(), pragmas, read_only=True, pool_size=read_pool_size,
+                                  max_overflow=pool_kwargs.get('max_overflow', 10))
+        if query_checker is not None:
+            query_checker.listen(read_engine)
+        __read_factory = orm.sessionmaker(bind=read_engine)
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=__dispose_after_fork)
+
+
+def __dispose_after_fork():
+    # sqlite connections must not be shared by processes, workers forked from a process that already
+    # connected (gunicorn --preload) get empty pools. close=False leaves parent's connections to the parent
+    for factory in (__factory, __read_factory):
+        if factory is not None:
+            factory.kw['bind'].dispose(close=False)
 
-    SqlAlchemyBase.metadata.create_all(engine)
+
+def apply_migrations():
+    """Apply migrations that are not applied yet, returns [(version, name)] of them."""
+    from .migrations import migrate, migration_lock
+
+    engine = __factory.kw['bind']
+    with migration_lock(engine.url.database):
+        return migrate(engine)
+
+
+def check_schema():
+    # one small query at start instead of inspecting every table
+    from .migrations import pending_migrations
+
+    pending = pending_migrations(__factory.kw['bind'])
+    if pending:
+        raise Exception(f"База данных не обновлена, миграции {', '.join(str(i[0]) for i in pending)} не применены. "
+                        f"Выполните flask --app server init-db")
+
+
+def __listen_pool(engine):
+    def on_connect(dbapi_connection, connection_record):
+        __pool_counters['connects'] += 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        __pool_counters['checkouts'] += 1
+        # connections above pool_size are overflow ones
+        if engine.pool.checkedout() > engine.pool.size():
+            __pool_counters['overflows'] += 1
+
+    def on_checkin(dbapi_connection, connection_record):
+        __pool_counters['checkins'] += 1
+
+    sa.event.listen(engine, 'connect', on_connect)
+    sa.event.listen(engine, 'checkout', on_checkout)
+    sa.event.listen(engine, 'checkin', on_checkin)
+
+
+def pool_stats():
+    # counters since start and current state of the pool
+    pool = __factory.kw['bind'].pool
+    return dict(__pool_counters, size=pool.size(), checked_out=pool.checkedout(), overflow=max(pool.overflow(), 0))
 
 
 def create_session() -> Session:
+    # inside of a request everyone (pages, api resources, login manager) shares one session,
+    # it is closed by close_session when request ends
     global __factory
-    return __factory()
+    if not has_app_context():
+        return __factory()
+
+    if 'db_session' not in g:
+        g.db_session = __factory()
+    return g.db_session
+
+
+def create_read_session() -> Session:
+    # session for requests that only read, it doesn't share identity map with create_session() one.
+    # if read only pool is disabled it is the same as create_session()
+    global __read_factory
+    if __read_factory is None:
+        return create_session()
+    if not has_app_context():
+        return __read_factory()
+
+    if 'db_read_session' not in g:
+        g.db_read_session = __read_factory()
+    return g.db_read_session
+
 
+def close_session(exception=None):
+    for key in ('db_session', 'db_read_session'):
+        session = g.pop(key, None)
+        if session is not None:
+            session.close()
@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+
+# widths of downsized copies of every uploaded image: avatars, main page grid, news page, news page on hidpi
+VARIANT_WIDTHS = (160, 320, 800, 1600)
+
+# format of downsized copies for every original format (bmp copies are made as png)
+VARIANT_FORMATS = {'jpg': 'jpg', 'jpeg': 'jpg', 'png': 'png', 'bmp': 'png'}
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+# "name.320w.jpg" - copy of "name.jpg" 320 pixels wide
+VARIANT_NAME = re.compile(r'\.\d+w\.(jpg|png|webp)$')
+
+# uploaded images are stored by sha256 of their content: img/blobs/ab/cd/abcd...ef.jpg (see blob.py)
+BLOB_FOLDER = 'img/blobs'
+BLOB_ID = re.compile(r'^[0-9a-f]{64}\.(png|jpg|bmp)$')
+
+__executor = None
+
+# workers have no app context, so errors of downsizing go to this logger
+logger = logging.getLogger(__name__)
+
+
+def __forget_executor():
+    # threads of the executor are not copied to a forked process, the child makes its own
+    global __executor
+    __executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=__forget_executor)
+
+
+def is_blob_id(value):
+    return bool(value) and BLOB_ID.match(value) is not None
+
+
+def blob_path(blob_id):
+    # path of stored image in static folder
+    return f'{BLOB_FOLDER}/{blob_id[:2]}/{blob_id[2:4]}/{blob_id}'
+
+
+def user_image_path(image):
+    # users have stored image or one of default pictures from img/users
+    return blob_path(image) if is_blob_id(image) else f'img/users/{image}'
+
+
+def variant_path(path, width, ext):
+    return f'{os.path.splitext(path)[0]}.{width}w.{ext}'
+
+
+def variant_paths(path):
+    # all copies of the image, the last one is written last
+    ext = VARIANT_FORMATS.get(path.rsplit('.', 1)[-1].lower())
+    if ext is None:
+        return []
+    return [variant_path(path, width, i) for i in (ext, 'webp') for width in VARIANT_WIDTHS]
+
+
+def make_variants(path):
+    ext = VARIANT_FORMATS.get(path.rsplit('.', 1)[-1].lower())
+    if ext is None or not os.path.exists(path):
+        return
+    # pillow is needed only for uploads, workers that don't get them don't import it
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+
+        for fmt in (ext, 'webp'):
+            for width in VARIANT_WIDTHS:
+                # we don't make images bigger, small images are just saved in new format
+                copy = image
+                if image.width > width:
+                    copy = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+                if fmt == 'jpg' and copy.mode != 'RGB':
+                    copy = copy.convert('RGB')
+
+                # write to temporary file and rename so no one sees half-written image
+                result = variant_path(path, width, fmt)
+                copy.save(f'{result}.tmp', PIL_FORMATS[fmt], quality=80, optimize=True)
+                os.replace(f'{result}.tmp', result)
+
+    # image could be deleted while we were making copies
+    if not os.path.exists(path):
+        remove_image(path)
+
+
+def make_variants_async(path):
+    # downsizing takes time, so it is done by background workers
+    global __executor
+    if __executor is None:
+        __executor = ThreadPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'],
+                                        thread_name_prefix='image-variants')
+    future = __executor.submit(make_variants, path)
+    future.add_done_callback(lambda done: log_variants_error(path, done))
+    return future
+
+
+def log_variants_error(path, future):
+    # broken images (right signature, wrong content) pass check_image and fail here
+    error = future.exception()
+    if error is not None:
+        logger.error('downsized copies of %s were not made', path, exc_info=error)
+
+
+def remove_image(path):
+    # remove image with all its copies
+    for i in [path] + variant_paths(path):
+        try:
+            os.remove(i)
+        except FileNotFoundError:
+            pass
+
+
+def image_urls(filename):
+    """Urls for <img> of image from static folder.
+
+    src - original image, srcset and webp_srcset - downsized copies (empty if they are not made yet)
+    """
+    urls = {'src': url_for('static', filename=filename), 'srcset': '', 'webp_srcset': ''}
+
+    paths = variant_paths(os.path.join(current_app.static_folder, filename))
+    if paths and os.path.exists(paths[-1]):
+        names = [os.path.relpath(i, current_app.static_folder).replace(os.sep, '/') for i in paths]
+        srcsets = [f'{url_for("static", filename=name)} {width}w' for name, width in
+                   zip(names, VARIANT_WIDTHS * 2)]
+        urls['srcset'] = ', '.join(srcsets[:len(VARIANT_WIDTHS)])
+        urls['webp_srcset'] = ', '.join(srcsets[len(VARIANT_WIDTHS):])
+    return urls
+
+
+def user_image_urls(image):
+    return image_urls(user_image_path(image))
+
+
+def news_first_image(news):
+    # first image of the news or "no image" picture
+    name = news.images.split(';')[0] if news.images else ''
+    if not is_blob_id(name):
+        return image_urls('img/news/no_image.png')
+    return image_urls(blob_path(name))
+
+
+def backfill_variants(folder):
+    # make copies for all images in the folder that don't have them yet, returns how many images were processed
+    count = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if VARIANT_NAME.search(name) or name.endswith('.tmp'):
+                continue
+            paths = variant_paths(path)
+            if paths and not os.path.exists(paths[-1]):
+                make_variants(path)
+                count += 1
+    return count
@@ -0,0 +1,98 @@
+import datetime
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+from flask_restful import abort
+
+# List endpoints (GET /api/news, /api/comments, /api/users) take:
+#   limit   - items on one page, answer is {"<key>": [...], "next_cursor": "..."} (null on the last page)
+#   cursor  - next_cursor of the previous page
+#   fields  - comma separated fields of items, like "id,title"
+#   filters - creator_id, news_id, since (iso date) where the list has them
+# Without limit the whole list is streamed from the database by parts, so memory doesn't grow with the table.
+# It is the same json as before ({"<key>": [...]}) or ndjson (one item per line)
+# with "Accept: application/x-ndjson" or "format=ndjson"
+
+MAX_LIMIT = 1000
+# rows fetched from the database at once when whole list is streamed
+STREAM_CHUNK_SIZE = 500
+
+NDJSON = 'application/x-ndjson'
+
+
+def parse_since(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def arg(name, parse):
+    # request argument parsed by parse or None, wrong value is 400 error
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse(value)
+    except ValueError:
+        abort(400, message=f'wrong value of "{name}": {value}')
+
+
+def parse_fields(allowed, default):
+    if request.args.get('fields') is None:
+        return default
+    fields = tuple(i.strip() for i in request.args['fields'].split(',') if i.strip())
+    unknown = [i for i in fields if i not in allowed]
+    if unknown or not fields:
+        abort(400, message=f'unknown fields: {", ".join(unknown)}. Allowed fields: {", ".join(allowed)}')
+    # without repeats and in order of allowed, so plans of Schema are kept for subsets of fields only
+    return tuple(i for i in allowed if i in fields)
+
+
+def filter_query(query, filters):
+    # filters: {argument name: (column, parse)}, "since" means column >= value, others - column == value
+    for name, (column, parse) in filters.items():
+        value = arg(name, parse)
+        if value is not None:
+            query = query.filter(column >= value if name == 'since' else column == value)
+    return query
+
+
+def dumps(item):
+    # same as jsonify does it (sorted keys, no spaces)
+    return current_app.json.dumps(item, separators=(',', ':'))
+
+
+def list_response(key, schema, query, fields):
+    # page of the list or the whole list streamed, ordered by id. query is schema.query() with filters
+    limit = arg('limit', int)
+    cursor = arg('cursor', int)
+    if limit is not None and not 0 < limit <= MAX_LIMIT:
+        abort(400, message=f'limit should be from 1 to {MAX_LIMIT}')
+
+    model = schema.model
+    to_dict = schema.plan(fields)[2]
+    query = query.order_by(model.id)
+    if cursor is not None:
+        query = query.filter(model.id > cursor)
+
+    if limit is not None:
+        # we take one more to know if there is next page
+        rows = query.limit(limit + 1).all()
+        # the last column is id
+        next_cursor = str(rows[limit - 1][-1]) if len(rows) > limit else None
+        return jsonify({key: [to_dict(row) for row in rows[:limit]], 'next_cursor': next_cursor})
+
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+    rows = query.yield_per(STREAM_CHUNK_SIZE)
+
+    def generate_ndjson():
+        for row in rows:
+            yield dumps(to_dict(row)) + '\n'
+
+    def generate_json():
+        yield f'{{"{key}":['
+        for number, row in enumerate(rows):
+            yield (',' if number else '') + dumps(to_dict(row))
+        yield ']}\n'
+
+    if ndjson:
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON)
+    return Response(stream_with_context(generate_json()), mimetype='application/json')
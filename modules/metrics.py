@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+
+import jinja2
+import sqlalchemy as sa
+from flask import Response, current_app, g, has_request_context, request
+
+# Counters of every request by endpoint (flask_restful resources are endpoints too, like "newsresource")
+# and method, served by /metrics in prometheus text format:
+#   http_requests_total                 - requests by status
+#   http_request_duration_seconds       - histogram of time from request start to response (without streaming)
+#   http_response_size_bytes            - sum and count of known response sizes
+#   db_statements_total, db_statement_seconds_total - sql statements made by requests and their time
+#   template_render_seconds             - sum and count of template rendering time by template
+# A request only adds numbers to its dict in g and takes the lock once when it ends.
+
+# histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # (endpoint, method, status) -> count
+        self.requests = {}
+        # (endpoint, method) -> [bucket counts..., +Inf count, sum]
+        self.durations = {}
+        # (endpoint, method) -> [size sum, count]
+        self.sizes = {}
+        # (endpoint, method) -> [statements, seconds]
+        self.statements = {}
+        # template -> [seconds, count]
+        self.templates = {}
+
+    def record(self, endpoint, method, status, seconds, size, statements, statement_seconds, templates):
+        key = endpoint, method
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self.__lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+
+            duration = self.durations.get(key)
+            if duration is None:
+                duration = self.durations[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            duration[bucket] += 1
+            duration[-1] += seconds
+
+            if size is not None:
+                sizes = self.sizes.setdefault(key, [0, 0])
+                sizes[0] += size
+                sizes[1] += 1
+
+            if statements:
+                counts = self.statements.setdefault(key, [0, 0.0])
+                counts[0] += statements
+                counts[1] += statement_seconds
+
+            for name, (render_seconds, count) in templates.items():
+                counts = self.templates.setdefault(name, [0.0, 0])
+                counts[0] += render_seconds
+                counts[1] += count
+
+    def render(self):
+        # prometheus text exposition format
+        with self.__lock:
+            requests = dict(self.requests)
+            durations = {key: list(value) for key, value in self.durations.items()}
+            sizes = {key: list(value) for key, value in self.sizes.items()}
+            statements = {key: list(value) for key, value in self.statements.items()}
+            templates = {key: list(value) for key, value in self.templates.items()}
+
+        lines = ['# HELP http_requests_total Requests by endpoint, method and status.',
+                 '# TYPE http_requests_total counter']
+        for (endpoint, method, status), count in sorted(requests.items()):
+            lines.append(f'http_requests_total{labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+        lines += ['# HELP http_request_duration_seconds Time of making the response.',
+                  '# TYPE http_request_duration_seconds histogram']
+        for (endpoint, method), duration in sorted(durations.items()):
+            total = 0
+            for le, count in zip(BUCKETS + ('+Inf',), duration):
+                total += count
+                lines.append(f'http_request_duration_seconds_bucket{labels(endpoint=endpoint, method=method, le=le)} '
+                             f'{total}')
+            lines.append(f'http_request_duration_seconds_sum{labels(endpoint=endpoint, method=method)} {duration[-1]}')
+            lines.append(f'http_request_duration_seconds_count{labels(endpoint=endpoint, method=method)} {total}')
+
+        lines += ['# HELP http_response_size_bytes Size of responses with known length.',
+                  '# TYPE http_response_size_bytes summary']
+        for (endpoint, method), (size, count) in sorted(sizes.items()):
+            lines.append(f'http_response_size_bytes_sum{labels(endpoint=endpoint, method=method)} {size}')
+            lines.append(f'http_response_size_bytes_count{labels(endpoint=endpoint, method=method)} {count}')
+
+        lines += ['# HELP db_statements_total SQL statements made by requests.',
+                  '# TYPE db_statements_total counter']
+        for (endpoint, method), (count, _) in sorted(statements.items()):
+            lines.append(f'db_statements_total{labels(endpoint=endpoint, method=method)} {count}')
+        lines += ['# HELP db_statement_seconds_total Time of SQL statements made by requests.',
+                  '# TYPE db_statement_seconds_total counter']
+        for (endpoint, method), (_, seconds) in sorted(statements.items()):
+            lines.append(f'db_statement_seconds_total{labels(endpoint=endpoint, method=method)} {seconds}')
+
+        lines += ['# HELP template_render_seconds Time of rendering templates.',
+                  '# TYPE template_render_seconds summary']
+        for name, (seconds, count) in sorted(templates.items()):
+            lines.append(f'template_render_seconds_sum{labels(template=name)} {seconds}')
+            lines.append(f'template_render_seconds_count{labels(template=name)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def labels(**values):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in values.items()) + '}'
+
+
+def gauges(name, help_text, values):
+    # lines of gauges {label value: number} with "name" label
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+    lines += [f'{name}{labels(name=key)} {value}' for key, value in sorted(values.items())]
+    return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+
+
+class TimedTemplate(jinja2.Template):
+    # flask signals need blinker which we don't have, so templates measure themselves
+    def render(self, *args, **kwargs):
+        if not has_request_context() or 'metrics' not in g:
+            return super().render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            templates = g.metrics['templates']
+            seconds, count = templates.get(self.name, (0.0, 0))
+            templates[self.name] = seconds + time.perf_counter() - start, count + 1
+
+
+def start_request():
+    if current_app.config['METRICS_ENABLED']:
+        g.metrics = {'start': time.perf_counter(), 'statements': 0, 'statement_seconds': 0.0, 'templates': {}}
+
+
+def finish_request(response):
+    data = g.pop('metrics', None)
+    if data is not None:
+        registry.record(request.endpoint or 'not_found', request.method, response.status_code,
+                        time.perf_counter() - data['start'], response.content_length,
+                        data['statements'], data['statement_seconds'], data['templates'])
+    return response
+
+
+def finish_failed_request(exc):
+    # after_request is not called if the view raised, it is 500 then
+    data = g.pop('metrics', None)
+    if data is not None and exc is not None:
+        registry.record(request.endpoint or 'not_found', request.method, 500, time.perf_counter() - data['start'],
+                        None, data['statements'], data['statement_seconds'], data['templates'])
+
+
+def before_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics' in g:
+        conn.info['metrics_statement_start'] = time.perf_counter()
+
+
+def after_statement(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('metrics_statement_start', None)
+    if start is not None and has_request_context() and 'metrics' in g:
+        g.metrics['statements'] += 1
+        g.metrics['statement_seconds'] += time.perf_counter() - start
+
+
+def init_app(app):
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(finish_failed_request)
+    # all engines: main, read only and the ones made later
+    if not sa.event.contains(sa.engine.Engine, 'before_cursor_execute', before_statement):
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', before_statement)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute', after_statement)
+
+
+def metrics_response():
+    from . import db_session, page_cache, user_cache
+
+    text = registry.render() + gauges('page_cache', 'Rendered pages cache counters and size.', page_cache.stats()) + \
+        gauges('user_cache', 'Logged in users cache counters and size.', user_cache.stats()) + \
+        gauges('db_pool', 'Connection pool counters and state.', db_session.pool_stats())
+    return Response(text, mimetype='text/plain; version=0.0.4')
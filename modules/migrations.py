@@ -0,0 +1,259 @@
+import contextlib
+import datetime
+
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from .db_session import SqlAlchemyBase
+
+# Schema of the database is changed only by migrations, they are applied by "flask --app server init-db"
+# (or at start with DB_MIGRATE=1), usual start only checks that none is pending (see db_session.check_schema).
+# Applied migrations are stored in schema_migrations table. New schema change is a new migration at the end
+# of MIGRATIONS with next version, it should be safe to run again (IF NOT EXISTS and so on): if the process dies
+# between the migration and its record, the migration is run again on next start.
+# Models describe the schema after all migrations (like index=True of columns indexed by migration 2),
+# but migrations never make tables from models.
+MIGRATIONS = []
+
+# Tables of migration 1 as they were when migrations appeared. Migration 1 uses them instead of the models,
+# so it makes the same schema whenever it is applied: later changes of models are only made by later migrations.
+# Don't change it
+SCHEMA_1 = sa.MetaData()
+
+sa.Table(
+    'users', SCHEMA_1,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('nickname', sa.String),
+    sa.Column('about', sa.String),
+    sa.Column('email', sa.String, index=True, unique=True),
+    sa.Column('hashed_password', sa.String),
+    sa.Column('modified_date', sa.DateTime),
+    sa.Column('image', sa.String))
+
+sa.Table(
+    'news', SCHEMA_1,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('title', sa.String, nullable=False),
+    sa.Column('about', sa.String, nullable=False),
+    sa.Column('images', sa.String),
+    sa.Column('tags', sa.String),
+    sa.Column('creation_date', sa.DateTime),
+    sa.Column('updated_at', sa.DateTime),
+    sa.Column('creator_id', sa.Integer, sa.ForeignKey('users.id', ondelete='SET NULL')),
+    sa.Column('comment_count', sa.Integer, nullable=False, server_default='0'),
+    sa.Column('last_comment_at', sa.DateTime),
+    sa.Index('ix_news_creation_date_id', 'creation_date', 'id'))
+
+sa.Table(
+    'comments', SCHEMA_1,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('text', sa.String, nullable=False),
+    sa.Column('creation_date', sa.DateTime),
+    sa.Column('updated_at', sa.DateTime),
+    sa.Column('is_edited', sa.Boolean),
+    sa.Column('creator_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    sa.Column('news_id', sa.Integer, sa.ForeignKey('news.id', ondelete='CASCADE')))
+
+sa.Table(
+    'tags', SCHEMA_1,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String, nullable=False, index=True, unique=True))
+
+sa.Table(
+    'news_tags', SCHEMA_1,
+    sa.Column('tag_id', sa.Integer, sa.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+    sa.Column('news_id', sa.Integer, sa.ForeignKey('news.id', ondelete='CASCADE'), primary_key=True, index=True))
+
+sa.Table(
+    'blobs', SCHEMA_1,
+    sa.Column('id', sa.String, primary_key=True),
+    sa.Column('size', sa.Integer, nullable=False),
+    sa.Column('ref_count', sa.Integer, nullable=False),
+    sa.Column('creation_date', sa.DateTime))
+
+sa.Table(
+    'table_versions', SCHEMA_1,
+    sa.Column('name', sa.String, primary_key=True),
+    sa.Column('version', sa.Integer, nullable=False))
+
+
+class SchemaMigration(SqlAlchemyBase):
+    __tablename__ = 'schema_migrations'
+
+    version = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String, nullable=False)
+    applied_at = sa.Column(sa.DateTime, nullable=False, default=datetime.datetime.now)
+
+
+def migration(version, name):
+    def decorator(function):
+        MIGRATIONS.append((version, name, function))
+        return function
+    return decorator
+
+
+def applied_versions(engine):
+    with engine.connect() as conn:
+        # new database has no tables at all
+        if not engine.dialect.has_table(conn, SchemaMigration.__tablename__):
+            return set()
+        return {row.version for row in conn.execute(sa.select(SchemaMigration.version))}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [(version, name, function) for version, name, function in MIGRATIONS if version not in applied]
+
+
+@contextlib.contextmanager
+def migration_lock(db_file):
+    # worker processes started together wait for each other here, so every migration is applied once
+    try:
+        import fcntl
+    except ImportError:
+        # no flock (windows), one process is expected there
+        yield
+        return
+    with open(db_file + '.migrate-lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate(engine):
+    """Apply not applied migrations in order of versions, returns [(version, name)] of applied ones."""
+    done = []
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    for version, name, function in pending_migrations(engine):
+        print(f'Миграция {version}: {name}')
+        function(engine)
+        with engine.begin() as conn:
+            conn.execute(sa.insert(SchemaMigration).values(version=version, name=name,
+                                                           applied_at=datetime.datetime.now()))
+        done.append((version, name))
+    return done
+
+
+@migration(1, 'schema of models')
+def schema_of_models(engine):
+    # databases made before migrations were changed by global_init at every start,
+    # this brings any of them (or an empty one) to SCHEMA_1
+    inspector = sa.inspect(engine)
+    # tags table appeared after news were already stored with tags strings
+    has_tags_table = inspector.has_table('news_tags')
+    # images were stored in news and users folders before blobs table appeared
+    has_blobs_table = inspector.has_table('blobs')
+
+    SCHEMA_1.create_all(engine)
+
+    # create_all doesn't add new columns, foreign keys actions and indexes to already existing tables
+    added_columns = add_missing_columns(engine, SCHEMA_1)
+    for table in SCHEMA_1.sorted_tables:
+        if foreign_keys_changed(engine, table):
+            rebuild_table(engine, table)
+    for table in SCHEMA_1.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    from .news_search import create_news_fts
+    create_news_fts(engine)
+
+    from .versions import create_versions
+    create_versions(engine)
+
+    with orm.Session(bind=engine) as session:
+        if not has_tags_table:
+            from .tag import migrate_tags
+            migrate_tags(session)
+
+        if not has_blobs_table:
+            from .blob import migrate_images
+            migrate_images(session)
+
+        # comment stats appeared when there were comments already
+        if ('news', 'comment_count') in added_columns:
+            from .comment import recount_comments
+            recount_comments(session)
+
+
+@migration(2, 'indexes of comments and news creators')
+def comments_and_creators_indexes(engine):
+    # comments of news page and api, comments of deleted user, news of profile page.
+    # News feed order (creation_date) has its index ix_news_creation_date_id already
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_comments_news_id ON comments (news_id)')
+        conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_comments_creator_id ON comments (creator_id)')
+        conn.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_news_creator_id ON news (creator_id)')
+        # statistics for query planner to choose between indexes
+        conn.exec_driver_sql('ANALYZE')
+
+
+@migration(3, 'deleted user')
+def deleted_user(engine):
+    # news of deleted users are given to user 1 (it was made by server.main before)
+    from .user import User
+
+    with orm.Session(bind=engine) as session:
+        if session.get(User, 1) is None:
+            session.add(User(id=1, nickname='deleted user', image='dead_user.png'))
+            session.commit()
+
+
+def add_missing_columns(engine, metadata):
+    # new columns of metadata tables are added to old tables, returns [(table, column)].
+    # Columns with server_default get it (and NOT NULL) like in new tables, other rows get NULL
+    inspector = sa.inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                    if column.server_default is not None:
+                        ddl += f' DEFAULT {column.server_default.arg}' + ('' if column.nullable else ' NOT NULL')
+                    conn.exec_driver_sql(ddl)
+                    added.append((table.name, column.name))
+    return added
+
+
+def foreign_keys_changed(engine, table):
+    # sqlite can't change foreign keys of a table, so tables with other ON DELETE actions are made again
+    actions = {(fk['constrained_columns'][0], (fk['options'].get('ondelete') or 'NO ACTION').upper())
+               for fk in sa.inspect(engine).get_foreign_keys(table.name)}
+    return actions != {(fk.parent.name, (fk.ondelete or 'NO ACTION').upper()) for fk in table.foreign_keys}
+
+
+def rebuild_table(engine, table):
+    # https://www.sqlite.org/lang_altertable.html#otheralter: new table, copy rows, drop old one, rename new one.
+    # Indexes and triggers of the old table are dropped with it, they are created again after it (schema_of_models)
+    columns = ', '.join(column.name for column in table.columns)
+    # columns added by add_missing_columns without default are NULL in old rows, not null ones get their default
+    values = ', '.join(f'COALESCE({column.name}, {column.server_default.arg})'
+                       if not column.nullable and column.server_default is not None
+                       else column.name for column in table.columns)
+    create = str(sa.schema.CreateTable(table).compile(engine)).replace(
+        f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}_new ', 1)
+
+    with engine.connect() as conn:
+        # the pragma doesn't work inside of a transaction
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        conn.commit()
+        try:
+            with conn.begin():
+                conn.exec_driver_sql(create)
+                conn.exec_driver_sql(f'INSERT INTO {table.name}_new ({columns}) SELECT {values} FROM {table.name}')
+                conn.exec_driver_sql(f'DROP TABLE {table.name}')
+                conn.exec_driver_sql(f'ALTER TABLE {table.name}_new RENAME TO {table.name}')
+                # rows that point to already deleted rows would break foreign keys checks
+                for fk in table.foreign_keys:
+                    action = 'DELETE FROM {0}' if fk.ondelete == 'CASCADE' else 'UPDATE {0} SET {1} = NULL'
+                    action += ' WHERE {1} IS NOT NULL AND {1} NOT IN (SELECT {3} FROM {2})'
+                    conn.exec_driver_sql(action.format(table.name, fk.parent.name, fk.column.table.name,
+                                                       fk.column.name))
+        finally:
+            # pooled connection must not stay without foreign keys if the rebuild failed
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+            conn.commit()
@@ -7,6 +7,10 @@ from sqlalchemy_serializer import SerializerMixin
 
 class News(SqlAlchemyBase, SerializerMixin):
     __tablename__ = 'news'
+    __table_args__ = (
+        # main page feed is ordered and paginated by (creation_date, id)
+        sqlalchemy.Index('ix_news_creation_date_id', 'creation_date', 'id'),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
 
@@ -18,8 +22,19 @@ class News(SqlAlchemyBase, SerializerMixin):
     tags = sqlalchemy.Column(sqlalchemy.String, nullable=True)
 
     creation_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
+    updated_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
-    creator_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("users.id"))
+    # news of deleted user are given to "deleted user" (id 1) before, SET NULL is only for the case it wasn't done.
+    # Its index is made by migration 2 (see migrations.py)
+    creator_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("users.id", ondelete='SET NULL'),
+                                   index=True)
     creator = orm.relationship('User')
 
-    comments = orm.relationship("Comment", back_populates='news')
+    # comments of deleted news are deleted by the database, they are not loaded for that
+    comments = orm.relationship("Comment", back_populates='news', cascade='all', passive_deletes=True)
+    # kept by update_comment_stats (comment.py) in the same transaction with comments changes
+    comment_count = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0, server_default='0')
+    last_comment_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=True)
+
+    # same tags as in "tags" string but in separate table so we can search by them
+    tag_list = orm.relationship('Tag', secondary='news_tags', back_populates='news', passive_deletes=True)
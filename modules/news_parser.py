@@ -5,4 +5,17 @@ parser.add_argument('title', required=True)
 parser.add_argument('about', required=True)
 parser.add_argument('tags', required=False)
 parser.add_argument('creator_id', required=True, type=int)
-parser.add_argument('creator_password', required=True)
+# not needed with api token (see api_auth.py)
+parser.add_argument('creator_password', required=False)
+
+# many news of one user in one request: {"creator_id": 2, "news": [{"title": ..., "about": ..., "tags": ...}]}
+batch_parser = reqparse.RequestParser()
+batch_parser.add_argument('creator_id', required=True, type=int)
+batch_parser.add_argument('creator_password', required=False)
+batch_parser.add_argument('news', required=True, type=list, location='json')
+
+# {"creator_id": 2, "ids": [1, 2, 3]}
+batch_delete_parser = reqparse.RequestParser()
+batch_delete_parser.add_argument('creator_id', required=True, type=int)
+batch_delete_parser.add_argument('creator_password', required=False)
+batch_delete_parser.add_argument('ids', required=True, type=list, location='json')
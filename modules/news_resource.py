@@ -1,11 +1,27 @@
 from flask_restful import reqparse, abort, Api, Resource
 from flask import jsonify, request
-from werkzeug.security import check_password_hash
 
 from . import db_session
 from .news import News
 from .user import User
-from .news_parser import parser
+from .news_parser import parser, batch_parser, batch_delete_parser
+from .tag import parse_tags, set_news_tags, set_many_news_tags
+from .news_search import search_news
+from .blob import release_blob
+from .api_auth import bearer_token, is_authorized
+from .batch import check_batch_size, parse_ids, batch_user, text_error
+from .page_cache import invalidate_on_commit
+from .list_api import MAX_LIMIT, arg, parse_fields, parse_since, filter_query, list_response
+from .schema import Schema
+from .versions import table_versions, make_etag, not_modified, with_etag
+
+# fields that api gives for news and fields that are given by default
+NEWS_SCHEMA = Schema(News, {
+    'id': News.id, 'title': News.title, 'about': News.about, 'creator.nickname': User.nickname, 'tags': News.tags,
+    'creator_id': News.creator_id, 'creation_date': News.creation_date, 'images': News.images,
+    'comment_count': News.comment_count, 'last_comment_at': News.last_comment_at
+}, {'creator': (User, News.creator_id == User.id)})
+NEWS_DEFAULT_FIELDS = ('id', 'title', 'about', 'creator.nickname', 'tags')
 
 
 def abort_if_news_not_found(news_id):
@@ -13,45 +29,51 @@ def abort_if_news_not_found(news_id):
     news = session.query(News).get(news_id)
     if not news:
         abort(404, message=f"News with id {news_id} not found")
+    return news
 
 
 class NewsResource(Resource):
     def get(self, news_id):
-        abort_if_news_not_found(news_id)
-        session = db_session.create_session()
-        news = session.query(News).get(news_id)
-        return jsonify({'news': news.to_dict(
-            only=('id', 'title', 'about', 'creator.nickname', 'tags'))})
+        session = db_session.create_read_session()
+        # answer has creator nickname, so it changes with the news and with its creator
+        stamp = session.query(News.updated_at, User.modified_date).outerjoin(User, News.creator_id == User.id) \
+            .filter(News.id == news_id).first()
+        if stamp is None:
+            abort(404, message=f"News with id {news_id} not found")
+
+        etag = make_etag(*stamp)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        return with_etag(jsonify({'news': NEWS_SCHEMA.first(session, NEWS_DEFAULT_FIELDS, News.id == news_id)}), etag)
 
     def delete(self, news_id):
-        abort_if_news_not_found(news_id)
+        news = abort_if_news_not_found(news_id)
 
-        creator_data = request.json
+        creator_data = request.get_json(silent=True) or {}
         session = db_session.create_session()
-        news = session.query(News).get(news_id)
 
         if news.creator.id == 1:
             abort(405, message=f"can't delete news (id={news_id}), belongs to deleted user")
 
-        if creator_data.get('creator_password') is None:
+        if creator_data.get('creator_password') is None and bearer_token() is None:
             abort(405, message=f'to delete news created by user with {news.creator.id} id'
-                               f' send his password in json with "creator_password" key. '
+                               f' send his api token or his password in json with "creator_password" key. '
                                f'Exception at news with id {news_id}')
 
-        if not check_password_hash(news.creator.hashed_password, creator_data['creator_password']):
+        if not is_authorized(news.creator, creator_data.get('creator_password')):
             return abort(405, message=f"password doesn't match news creator password, "
                                       f"can't delete news with id {news_id}")
 
-        for com in news.comments:
-            session.delete(com)
-        session.commit()
-
+        for blob_id in news.images.split(';'):
+            release_blob(session, blob_id)
+        # comments and tags links are deleted by the database (ON DELETE CASCADE)
         session.delete(news)
         session.commit()
         return jsonify({'success': 'OK'})
 
     def put(self, news_id):
-        abort_if_news_not_found(news_id)
+        news = abort_if_news_not_found(news_id)
 
         # if there's no json error 400 pops and there is no way to control it...
         args = request.json
@@ -60,16 +82,15 @@ class NewsResource(Resource):
 
         session = db_session.create_session()
 
-        news = session.query(News).get(news_id)
-
-        if args['creator_password'] is None:
-            abort(405, message=f"you need user password to change one of his news. Json key is 'creator_password'. "
+        if args['creator_password'] is None and bearer_token() is None:
+            abort(405, message=f"you need user api token or password to change one of his news. "
+                               f"Json key is 'creator_password'. "
                                f"Exeption at news with id {news_id}")
 
         if news.creator.hashed_password is None:
             abort(405, message=f"can't change this user news (deleted user)")
 
-        if not check_password_hash(news.creator.hashed_password, args['creator_password']):
+        if not is_authorized(news.creator, args['creator_password']):
             abort(405, message=f"user password doesn't match with sent one."
                                f"Exception at news with id {news_id}")
 
@@ -79,7 +100,8 @@ class NewsResource(Resource):
 
         news.title = args['title'] if args['title'] is not None else news.title
         news.about = args['about'] if args['about'] is not None else news.about
-        news.tags = ';'.join(f' {args["tags"]}'.split(' #'))[1:] if args['tags'] is not None else news.tags
+        if args['tags'] is not None:
+            set_news_tags(session, news, parse_tags(args['tags']))
 
         session.commit()
         return jsonify({'success': 'OK'})
@@ -87,10 +109,33 @@ class NewsResource(Resource):
 
 class NewsListResource(Resource):
     def get(self):
-        session = db_session.create_session()
-        news = session.query(News).all()
-        return jsonify({'news': [item.to_dict(
-            only=('id', 'title', 'about', 'creator.nickname', 'tags')) for item in news]})
+        session = db_session.create_read_session()
+
+        etag = make_etag(table_versions(session, ('news', 'users')))
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        # full-text search by words in title and about
+        if request.args.get('q'):
+            limit = arg('limit', int)
+            limit = 50 if limit is None else limit
+            if not 0 < limit <= MAX_LIMIT:
+                abort(400, message=f'limit should be from 1 to {MAX_LIMIT}')
+            offset = arg('offset', int) or 0
+            if offset < 0:
+                abort(400, message='offset should not be negative')
+            results = search_news(session, request.args['q'], limit, offset)
+            rows = NEWS_SCHEMA.query(session, NEWS_DEFAULT_FIELDS).filter(
+                News.id.in_([item.id for item, _, _ in results]))
+            news = {row[-1]: NEWS_SCHEMA.to_dict(row, NEWS_DEFAULT_FIELDS) for row in rows}
+            return with_etag(jsonify({'news': [dict(news[item.id], snippet=str(snippet))
+                                               for item, _, snippet in results]}), etag)
+
+        fields = parse_fields(tuple(NEWS_SCHEMA.fields), NEWS_DEFAULT_FIELDS)
+        query = filter_query(NEWS_SCHEMA.query(session, fields), {'creator_id': (News.creator_id, int),
+                                                                  'since': (News.creation_date, parse_since)})
+        return with_etag(list_response('news', NEWS_SCHEMA, query, fields), etag)
 
     def post(self):
         args = parser.parse_args()
@@ -104,7 +149,7 @@ class NewsListResource(Resource):
         if args['creator_id'] == 1:
             abort(405, message=f"can't change this user news (deleted user)")
 
-        if check_password_hash(user.hashed_password, args['creator_password']):
+        if not is_authorized(user, args['creator_password']):
             abort(405, message=f"user password doesn't match with sent one. Can't create news by invalid user")
 
         if args['tags'] is not None and args['tags'][0] != '#':
@@ -113,10 +158,68 @@ class NewsListResource(Resource):
         news = News(
             title=args['title'],
             about=args['about'],
-            tags=';'.join(f' {args["tags"]}'.split(' #'))[1:] if args['tags'] is not None else '',
             creator_id=args['creator_id']
         )
+        set_news_tags(session, news, parse_tags(args['tags']))
 
         session.add(news)
         session.commit()
         return jsonify({'success': 'OK'})
+
+
+class NewsBatchResource(Resource):
+    def post(self):
+        args = batch_parser.parse_args()
+        check_batch_size(args['news'])
+        session = db_session.create_session()
+        user = batch_user(session, args['creator_id'], args['creator_password'])
+
+        results, created = [], []
+        for index, item in enumerate(args['news']):
+            error = text_error(item, ('title', 'about'))
+            if error is None and (not isinstance(item.get('tags') or '', str) or
+                                  item.get('tags') and item['tags'][0] != '#'):
+                error = 'news tags should start with "#" like that: #tag1 #tag2.'
+            if error is not None:
+                results.append({'index': index, 'error': error})
+                continue
+            created.append((index, News(title=item['title'], about=item['about'], creator_id=user.id),
+                            parse_tags(item.get('tags'))))
+
+        # all news are inserted by one flush
+        set_many_news_tags(session, [(news, names) for _, news, names in created])
+        session.add_all([news for _, news, _ in created])
+        session.flush()
+        # ids are taken before commit, after it every news would be loaded again
+        results += [{'index': index, 'id': news.id} for index, news, _ in created]
+        session.commit()
+        return jsonify({'success': 'OK', 'results': sorted(results, key=lambda x: x['index'])})
+
+    def delete(self):
+        args = batch_delete_parser.parse_args()
+        ids = parse_ids(args['ids'])
+        session = db_session.create_session()
+        user = batch_user(session, args['creator_id'], args['creator_password'])
+
+        found = {row.id: row for row in session.query(News.id, News.creator_id, News.images).filter(News.id.in_(ids))}
+        results, deleted = [], []
+        for index, news_id in enumerate(ids):
+            if news_id not in found:
+                results.append({'index': index, 'id': news_id, 'error': f'News with id {news_id} not found'})
+            elif found[news_id].creator_id != user.id:
+                results.append({'index': index, 'id': news_id, 'error': 'news belongs to another user'})
+            else:
+                results.append({'index': index, 'id': news_id})
+                deleted.append(news_id)
+
+        if deleted:
+            # comments and tags links are deleted by the database (ON DELETE CASCADE)
+            session.query(News).filter(News.id.in_(deleted)).delete(synchronize_session=False)
+            for news_id in set(deleted):
+                for blob_id in found[news_id].images.split(';'):
+                    release_blob(session, blob_id)
+
+            invalidate_on_commit(session, {'news', f'user-news:{user.id}'} |
+                                 {f'{tag}:{i}' for i in deleted for tag in ('news', 'comments')})
+        session.commit()
+        return jsonify({'success': 'OK', 'results': results})
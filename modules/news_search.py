@@ -0,0 +1,68 @@
+import sqlalchemy
+from markupsafe import Markup, escape
+
+from .news import News
+
+# full-text index over news title and about. It stores only the index (content='news'),
+# text itself is taken from news table. Triggers keep it in sync with news table
+FTS_TABLE = """CREATE VIRTUAL TABLE news_fts USING fts5(title, about, content='news', content_rowid='id',
+                                                      tokenize='unicode61 remove_diacritics 2')"""
+# triggers are created again if news table was made again (see migrations.rebuild_table)
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS news_fts_insert AFTER INSERT ON news BEGIN
+        INSERT INTO news_fts(rowid, title, about) VALUES (new.id, new.title, new.about);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS news_fts_delete AFTER DELETE ON news BEGIN
+        INSERT INTO news_fts(news_fts, rowid, title, about) VALUES ('delete', old.id, old.title, old.about);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS news_fts_update AFTER UPDATE OF title, about ON news BEGIN
+        INSERT INTO news_fts(news_fts, rowid, title, about) VALUES ('delete', old.id, old.title, old.about);
+        INSERT INTO news_fts(rowid, title, about) VALUES (new.id, new.title, new.about);
+    END"""
+]
+
+# snippet() puts these around found words, we replace them with <mark> after escaping the text
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def create_news_fts(engine):
+    has_table = sqlalchemy.inspect(engine).has_table('news_fts')
+    with engine.begin() as conn:
+        if not has_table:
+            conn.exec_driver_sql(FTS_TABLE)
+        for statement in FTS_TRIGGERS:
+            conn.exec_driver_sql(statement)
+        if not has_table:
+            # index news that were added before the index existed
+            conn.exec_driver_sql("INSERT INTO news_fts(news_fts) VALUES ('rebuild')")
+
+
+def make_fts_query(text):
+    # every word is quoted so user input can't break fts query syntax, words are joined with AND
+    words = text.split()
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_news(session, text, limit, offset=0):
+    """Search news by words in title and about, best matches first (bm25).
+
+    returns list of (news, highlighted title, highlighted about snippet)
+    """
+    query = make_fts_query(text)
+    if not query:
+        return []
+
+    rows = session.execute(sqlalchemy.text(
+        f"""SELECT rowid,
+                   highlight(news_fts, 0, '{MARK_START}', '{MARK_END}'),
+                   snippet(news_fts, 1, '{MARK_START}', '{MARK_END}', '...', 24)
+            FROM news_fts WHERE news_fts MATCH :query
+            ORDER BY bm25(news_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset"""),
+        {'query': query, 'limit': limit, 'offset': offset}).all()
+
+    news = {i.id: i for i in session.query(News).filter(News.id.in_([row[0] for row in rows]))}
+    return [(news[row[0]], highlight(row[1]), highlight(row[2])) for row in rows if row[0] in news]
@@ -0,0 +1,197 @@
+import functools
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask import current_app, g, request
+from flask_login import current_user
+from sqlalchemy.orm import Session
+
+from .comment import Comment
+from .news import News
+from .user import User
+from . import db_session
+from .versions import VERSIONED_TABLES, table_versions
+
+# Pages for anonymous users are the same for everyone, so they are rendered once and kept in memory.
+# Every cached page has tags of the things shown on it:
+#   "news"            - list of news (main page), changes when news are added or deleted
+#   "news:<id>"       - pages showing news title, about, images or tags
+#   "comments:<id>"   - page of the news with its comments
+#   "user:<id>"       - pages showing user nickname, picture or about
+#   "user-news:<id>"  - profile page with news of the user
+# When a session commits changes, pages with tags of changed objects are removed (see tags_of).
+
+
+class PageCache:
+    """LRU cache of rendered pages with a limit of memory they take."""
+
+    def __init__(self, max_bytes=0, ttl=0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (html, tags, size, time it was put)
+        self.__entries = OrderedDict()
+        # tag -> keys of pages with this tag
+        self.__tags = {}
+        self.__bytes = 0
+        # changed on every invalidation, pages rendered while something was invalidated are not stored
+        self.generation = 0
+        self.__lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[3] > self.ttl:
+                self.__remove(key)
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, html, tags, generation):
+        size = sys.getsizeof(html)
+        with self.__lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = (html, tags, size, time.monotonic())
+            self.__bytes += size
+            for tag in tags:
+                self.__tags.setdefault(tag, set()).add(key)
+
+            # least recently used pages are removed first
+            while self.__bytes > self.max_bytes:
+                self.__remove(next(iter(self.__entries)))
+                self.counters['evictions'] += 1
+
+    def invalidate(self, tags):
+        with self.__lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.__tags.get(tag, ())):
+                    self.__remove(key)
+                    self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.generation += 1
+            self.__entries.clear()
+            self.__tags.clear()
+            self.__bytes = 0
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.counters, entries=len(self.__entries), bytes=self.__bytes, max_bytes=self.max_bytes)
+
+    def __remove(self, key):
+        _, tags, size, _ = self.__entries.pop(key)
+        self.__bytes -= size
+        for tag in tags:
+            keys = self.__tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self.__tags[tag]
+
+
+cache = PageCache()
+
+
+def init_app(app):
+    cache.max_bytes = app.config['PAGE_CACHE_SIZE']
+    cache.ttl = app.config['PAGE_CACHE_TTL']
+    cache.clear()
+
+
+def add_tags(*tags):
+    # called by cached views to tell what is shown on the page
+    if 'page_cache_tags' in g:
+        g.page_cache_tags.update(tags)
+
+
+def cached(view):
+    """Serve page from the cache to anonymous users.
+
+    view should call add_tags for everything it shows, only 200 html responses are stored
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        if request.method != 'GET' or not cache.max_bytes or current_user.is_authenticated:
+            return view(**kwargs)
+
+        key = (request.endpoint, tuple(sorted(kwargs.items())), request.args.get('after'),
+               request.args.get('before'))
+        if current_app.config['PAGE_CACHE_CHECK_VERSIONS']:
+            # other processes don't invalidate our pages, so pages made before any change are not used.
+            # Versions are read before rendering, page made during a change is kept with old versions
+            key += tuple(table_versions(db_session.create_read_session(), VERSIONED_TABLES))
+        html = cache.get(key)
+        if html is not None:
+            return html, {'X-Cache': 'HIT'}
+
+        generation = cache.generation
+        g.page_cache_tags = set()
+        result = view(**kwargs)
+        if isinstance(result, str):
+            cache.put(key, result, frozenset(g.page_cache_tags), generation)
+            return result, {'X-Cache': 'MISS'}
+        return result
+
+    return wrapper
+
+
+def tags_of(obj, new=False, deleted=False):
+    # tags of pages that show the object
+    if isinstance(obj, News):
+        tags = {f'news:{obj.id}', f'user-news:{obj.creator_id}'}
+        # news moved to other user (deleted user) disappear from old creator profile
+        tags.update(f'user-news:{i}' for i in sa.inspect(obj).attrs.creator_id.history.deleted)
+        if new or deleted:
+            tags.add('news')
+        return tags
+    if isinstance(obj, Comment):
+        return {f'comments:{obj.news_id}'} | \
+            {f'comments:{i}' for i in sa.inspect(obj).attrs.news_id.history.deleted}
+    if isinstance(obj, User) and not new:
+        return {f'user:{obj.id}', f'user-news:{obj.id}'}
+    return set()
+
+
+def invalidate_on_commit(session, tags):
+    # for changes made by bulk update and delete statements, session doesn't see changed objects
+    session.info.setdefault('page_cache_tags', set()).update(tags)
+
+
+@sa.event.listens_for(Session, 'after_flush')
+def collect_tags(session, flush_context):
+    tags = session.info.setdefault('page_cache_tags', set())
+    for obj in session.new:
+        tags.update(tags_of(obj, new=True))
+    for obj in session.dirty:
+        # collections (like news.comments) are changed by their items, they are checked separately
+        if session.is_modified(obj, include_collections=False):
+            tags.update(tags_of(obj))
+    for obj in session.deleted:
+        tags.update(tags_of(obj, deleted=True))
+
+
+@sa.event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    tags = session.info.pop('page_cache_tags', None)
+    if tags:
+        cache.invalidate(tags)
+
+
+@sa.event.listens_for(Session, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop('page_cache_tags', None)
+
+
+def stats():
+    return cache.stats()
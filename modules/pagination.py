@@ -0,0 +1,50 @@
+import datetime
+
+from sqlalchemy import tuple_
+
+from .news import News
+
+
+# cursor is "<creation_date in iso format>_<news id>" of the first or the last news on the page
+def make_cursor(news):
+    return f'{news.creation_date.isoformat()}_{news.id}'
+
+
+def parse_cursor(cursor):
+    # returns None if cursor is broken
+    try:
+        date, news_id = cursor.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(date), int(news_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def paginate_news(query, page_size, after=None, before=None):
+    """Keyset pagination of news query, newest news first.
+
+    after - cursor of the last news on previous page (go to older news)
+    before - cursor of the first news on next page (go to newer news)
+    returns (news, cursor for older page or None, cursor for newer page or None)
+    """
+    key = tuple_(News.creation_date, News.id)
+
+    if before is not None:
+        # we go back to newer news, so we take them in ascending order and then reverse
+        rows = query.filter(key > before).order_by(News.creation_date, News.id).limit(page_size + 1).all()
+        has_newer = len(rows) > page_size
+        news = rows[:page_size][::-1]
+        has_older = True
+    else:
+        if after is not None:
+            query = query.filter(key < after)
+        rows = query.order_by(News.creation_date.desc(), News.id.desc()).limit(page_size + 1).all()
+        has_older = len(rows) > page_size
+        news = rows[:page_size]
+        has_newer = after is not None
+
+    if not news:
+        return news, None, None
+
+    older_cursor = make_cursor(news[-1]) if has_older else None
+    newer_cursor = make_cursor(news[0]) if has_newer else None
+    return news, older_cursor, newer_cursor
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Development and canary mode that finds queries made in loops (N+1) and slow queries.
+# Every statement of a request is recorded with its normalized sql (values and IN lists replaced by "?")
+# and the place in our code it came from. When the request ends, statements of the same shape made
+# max_repeats or more times and statements longer than slow_ms are problems. Every request with problems is
+# one json line in the log file:
+#   {"time": ..., "method": "GET", "path": "/", "endpoint": "pages.main_page", "statements": 35, "sql_ms": 4.1,
+#    "problems": [{"kind": "repeated", "count": 32, "sql": "SELECT ... WHERE users.id = ?",
+#                  "stack": ["server.py:110 main_page", "templates/main_page.html:20 top-level template code"]}]}
+# With log_all=True every request is logged with all its statements ("queries"), not only problems.
+# With strict=True such request fails with QueryCheckError, so tests running through it fail too.
+# Enabled by QUERY_CHECK=1 (see server.py), it costs a stack walk for every statement.
+
+THIS_FILE = os.path.abspath(__file__)
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(THIS_FILE))
+
+NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+STRING = re.compile(r"'(?:[^']|'')*'")
+IN_LIST = re.compile(r"\bIN \((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+SPACES = re.compile(r'\s+')
+
+
+class QueryCheckError(Exception):
+    pass
+
+
+def normalize(statement):
+    # same query with other values gives the same text
+    statement = STRING.sub('?', statement)
+    statement = NUMBER.sub('?', statement)
+    statement = SPACES.sub(' ', statement).strip()
+    return IN_LIST.sub('IN (?)', statement)
+
+
+def our_file(filename):
+    # relative path of our code file or None for libraries, this module and code made at runtime ("<string>")
+    if filename.startswith('<'):
+        return None
+    filename = os.path.abspath(filename)
+    if not filename.startswith(PROJECT_FOLDER) or filename == THIS_FILE or 'site-packages' in filename:
+        return None
+    return os.path.relpath(filename, PROJECT_FOLDER)
+
+
+def call_site(limit=5):
+    # nearest frames of our code first, template lines included
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < limit:
+        filename = our_file(frame.f_code.co_filename)
+        if filename is not None:
+            lineno = frame.f_lineno
+            template = frame.f_globals.get('__jinja_template__')
+            if template is not None:
+                # line of the template, not of the python code jinja made from it
+                lineno = template.get_corresponding_lineno(lineno)
+            frames.append(f'{filename}:{lineno} {frame.f_code.co_name}')
+        frame = frame.f_back
+    return frames
+
+
+class QueryChecker:
+    def __init__(self, slow_ms=100, max_repeats=5, log_file=None, strict=False, log_all=False):
+        self.slow_ms = slow_ms
+        self.max_repeats = max_repeats
+        self.log_file = log_file
+        self.strict = strict
+        self.log_all = log_all
+        self.__lock = threading.Lock()
+
+    def listen(self, engine):
+        # called by db_session.global_init for every engine
+        import sqlalchemy as sa
+
+        sa.event.listen(engine, 'before_cursor_execute', self.before_statement)
+        sa.event.listen(engine, 'after_cursor_execute', self.after_statement)
+
+    def init_app(self, app):
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def before_statement(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'query_check' in g:
+            conn.info['query_check_start'] = time.perf_counter()
+
+    def after_statement(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('query_check_start', None)
+        if start is None or not has_request_context() or 'query_check' not in g:
+            return
+        ms = (time.perf_counter() - start) * 1000
+        shapes = g.query_check
+        shape = normalize(statement)
+        if shape not in shapes:
+            # stack of the first one is enough to find the loop
+            shapes[shape] = {'count': 0, 'ms': 0.0, 'max_ms': 0.0, 'stack': call_site()}
+        info = shapes[shape]
+        info['count'] += 1
+        info['ms'] += ms
+        if ms > info['max_ms']:
+            info['max_ms'] = ms
+            if ms >= self.slow_ms:
+                info['slow_stack'] = call_site()
+
+    def start_request(self):
+        g.query_check = {}
+
+    def problems(self, shapes):
+        found = []
+        for shape, info in shapes.items():
+            if info['count'] >= self.max_repeats:
+                found.append({'kind': 'repeated', 'count': info['count'], 'ms': round(info['ms'], 2), 'sql': shape,
+                              'stack': info['stack']})
+            if info['max_ms'] >= self.slow_ms:
+                found.append({'kind': 'slow', 'ms': round(info['max_ms'], 2), 'sql': shape,
+                              'stack': info.get('slow_stack', info['stack'])})
+        return found
+
+    def finish_request(self, response):
+        shapes = g.pop('query_check', None)
+        if shapes is None:
+            return response
+        problems = self.problems(shapes)
+        if not problems and not self.log_all:
+            return response
+
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'statements': sum(info['count'] for info in shapes.values()),
+            'sql_ms': round(sum(info['ms'] for info in shapes.values()), 2),
+            'problems': problems
+        }
+        if self.log_all:
+            entry['queries'] = [{'sql': shape, 'count': info['count'], 'ms': round(info['ms'], 2),
+                                 'stack': info['stack']} for shape, info in shapes.items()]
+        if self.log_file:
+            with self.__lock, open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        else:
+            print(json.dumps(entry, ensure_ascii=False, indent=2))
+
+        if self.strict and problems:
+            raise QueryCheckError(f'{request.method} {request.path}: ' + '; '.join(
+                f'{i["kind"]} ({i.get("count", i["ms"])}): {i["sql"][:200]}' for i in problems))
+        return response
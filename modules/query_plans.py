@@ -0,0 +1,48 @@
+import datetime
+
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from .news import News
+from .comment import Comment
+from .migrations import migrate
+from . import __all_models
+
+# EXPLAIN QUERY PLAN of the queries every page and api list makes. A query that reads the whole table
+# ("SCAN comments" without an index) or sorts it ("USE TEMP B-TREE FOR ORDER BY") means an index is missing:
+#   flask --app server check-query-plans (tests/test_query_plans.py checks them too)
+# Plans are made on an empty database with all migrations applied: on a small real database sqlite
+# reads whole tables even when there are indexes, because it is faster for a few rows
+QUERIES = {
+    'comments of news': lambda: sa.select(Comment).where(Comment.news_id.in_([1])),
+    'comments of user': lambda: sa.select(Comment.news_id).where(Comment.creator_id == 1).distinct(),
+    'news of user': lambda: sa.select(News).where(News.creator_id == 1),
+    'news feed': lambda: sa.select(News).order_by(News.creation_date.desc(), News.id.desc()).limit(11),
+    'news feed page': lambda: sa.select(News)
+    .where(sa.tuple_(News.creation_date, News.id) < (datetime.datetime(2000, 1, 1), 1))
+    .order_by(News.creation_date.desc(), News.id.desc()).limit(11),
+}
+
+
+def query_plan(session, statement):
+    # lines of EXPLAIN QUERY PLAN, like "SEARCH comments USING INDEX ix_comments_news_id (news_id=?)"
+    compiled = statement.compile(session.get_bind(), compile_kwargs={'literal_binds': True})
+    return [row.detail for row in session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}')]
+
+
+def bad_plan_lines(plan):
+    return [line for line in plan if (line.startswith('SCAN ') and ' USING ' not in line) or
+            line.startswith('USE TEMP B-TREE FOR ORDER BY')]
+
+
+def check_query_plans():
+    # {query name: (plan, bad lines)} of all QUERIES
+    engine = sa.create_engine('sqlite://', poolclass=sa.pool.StaticPool)
+    migrate(engine)
+    result = {}
+    with orm.Session(bind=engine) as session:
+        for name, statement in QUERIES.items():
+            plan = query_plan(session, statement())
+            result[name] = plan, bad_plan_lines(plan)
+    engine.dispose()
+    return result
@@ -0,0 +1,82 @@
+import sqlalchemy as sa
+
+# Api answers are made from rows with exactly the needed columns instead of SerializerMixin.to_dict,
+# which inspects the model and loads relationships for every object. A resource declares its fields:
+#   Schema(News, {'id': News.id, 'creator.nickname': User.nickname},
+#          {'creator': (User, News.creator_id == User.id)})
+# "relation.field" fields are taken from an outer join and give {"relation": {"field": ...}} like to_dict does
+# ({"relation": null} if there is no related object). Dates are formatted like SerializerMixin does it.
+
+DATE_FORMATS = [
+    (sa.DateTime, '%Y-%m-%d %H:%M:%S'),
+    (sa.Date, '%Y-%m-%d'),
+    (sa.Time, '%H:%M')
+]
+
+
+def date_format(column):
+    for column_type, fmt in DATE_FORMATS:
+        if isinstance(column.type, column_type):
+            return fmt
+    return None
+
+
+class Schema:
+    def __init__(self, model, fields, joins=None):
+        """model - model of the list, fields - {field name: column},
+        joins - {relation: (model, on clause)} for "relation.field" fields
+        """
+        self.model = model
+        self.fields = fields
+        self.joins = joins or {}
+        # fields tuple -> (columns, function row -> dict), made once for every set of fields
+        self.__plans = {}
+
+    def plan(self, fields):
+        if fields not in self.__plans:
+            self.__plans[fields] = self.__make_plan(fields)
+        return self.__plans[fields]
+
+    def __make_plan(self, fields):
+        flat = tuple(name for name in fields if '.' not in name)
+        nested = tuple(tuple(name.split('.', 1)) for name in fields if '.' in name)
+        relations = tuple(sorted({relation for relation, _ in nested}))
+
+        # columns: fields without relation, fields of relations, primary key of every relation, id of the model
+        columns = [self.fields[name] for name in flat] + [self.fields['.'.join(i)] for i in nested] + \
+                  [sa.inspect(self.joins[relation][0]).primary_key[0] for relation in relations] + [self.model.id]
+
+        formats = tuple((name, date_format(self.fields[name])) for name in flat
+                        if date_format(self.fields[name]) is not None)
+        nested_keys = tuple((len(flat) + number, relation, key) for number, (relation, key) in enumerate(nested))
+        relation_keys = tuple((len(flat) + len(nested) + number, relation) for number, relation in enumerate(relations))
+
+        def to_dict(row):
+            item = dict(zip(flat, row))
+            for name, fmt in formats:
+                if item[name] is not None:
+                    item[name] = item[name].strftime(fmt)
+            for index, relation in relation_keys:
+                item[relation] = None if row[index] is None else {}
+            for index, relation, key in nested_keys:
+                if item[relation] is not None:
+                    item[relation][key] = row[index]
+            return item
+
+        return columns, relations, to_dict
+
+    def query(self, session, fields):
+        # query of rows for fields, the last column of every row is id of the model
+        columns, relations, _ = self.plan(fields)
+        query = session.query(*columns).select_from(self.model)
+        for relation in relations:
+            query = query.outerjoin(*self.joins[relation])
+        return query
+
+    def to_dict(self, row, fields):
+        return self.plan(fields)[2](row)
+
+    def first(self, session, fields, *criteria):
+        # dict of the first item matching criteria or None
+        row = self.query(session, fields).filter(*criteria).first()
+        return None if row is None else self.to_dict(row, fields)
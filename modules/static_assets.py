@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+from flask import request
+
+from .images import BLOB_FOLDER
+
+# a year, browsers never ask for such files again
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# static file name -> short hash of its content, made once at start
+__manifest = {}
+
+
+def build_manifest(static_folder):
+    # blobs are already named by their content hash, so we don't read them
+    manifest = {}
+    blobs = os.path.join(static_folder, BLOB_FOLDER)
+    for root, folders, files in os.walk(static_folder):
+        folders[:] = [i for i in folders if os.path.join(root, i) != blobs]
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()[:12]
+            manifest[os.path.relpath(path, static_folder).replace(os.sep, '/')] = digest
+    return manifest
+
+
+def add_fingerprint(endpoint, values):
+    # url_for('static', filename='css/base.css') -> /static/css/base.css?v=<hash of base.css>
+    if endpoint == 'static' and values.get('filename') in __manifest:
+        values.setdefault('v', __manifest[values['filename']])
+
+
+def is_immutable(filename):
+    # file can't change if its url has its content hash
+    if filename.startswith(f'{BLOB_FOLDER}/'):
+        return True
+    return request.args.get('v') is not None and request.args.get('v') == __manifest.get(filename)
+
+
+def set_cache_headers(response):
+    # send_file already answers If-None-Match / If-Modified-Since with 304 and Range with 206,
+    # we only tell browsers they can keep fingerprinted files forever
+    if request.endpoint == 'static' and response.status_code in (200, 206, 304) and \
+            is_immutable(request.view_args['filename']):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def init_app(app):
+    __manifest.clear()
+    __manifest.update(build_manifest(app.static_folder))
+    app.url_defaults(add_fingerprint)
+    app.after_request(set_cache_headers)
@@ -0,0 +1,75 @@
+import sqlalchemy
+from sqlalchemy import orm
+from .db_session import SqlAlchemyBase
+
+
+# many-to-many news <-> tags, primary key (tag_id, news_id) works as inverted index tag -> news
+news_tags = sqlalchemy.Table(
+    'news_tags', SqlAlchemyBase.metadata,
+    sqlalchemy.Column('tag_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('tags.id', ondelete='CASCADE'),
+                      primary_key=True),
+    sqlalchemy.Column('news_id', sqlalchemy.Integer, sqlalchemy.ForeignKey('news.id', ondelete='CASCADE'),
+                      primary_key=True, index=True)
+)
+
+
+class Tag(SqlAlchemyBase):
+    __tablename__ = 'tags'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+
+    name = sqlalchemy.Column(sqlalchemy.String, nullable=False, index=True, unique=True)
+
+    news = orm.relationship('News', secondary=news_tags, back_populates='tag_list')
+
+
+def parse_tags(text):
+    # "#tag1 #tag2 #tag1" -> ['tag1', 'tag2']
+    if not text:
+        return []
+    tags = set(i.strip() for i in f' {text}'.split(' #')[1:])
+    tags.discard('')
+    return sorted(tags)
+
+
+def set_news_tags(session, news, names):
+    # updates both tags string of the news and tags table
+    names = sorted(set(names))
+    tags = session.query(Tag).filter(Tag.name.in_(names)).all() if names else []
+    known = {tag.name for tag in tags}
+    tags += [Tag(name=name) for name in names if name not in known]
+
+    news.tags = ';'.join(names)
+    news.tag_list = tags
+
+
+def set_many_news_tags(session, items):
+    # set_news_tags for many news at once with one query, items are (news, tag names)
+    names = set(name for _, news_names in items for name in news_names)
+    tags = {tag.name: tag for tag in session.query(Tag).filter(Tag.name.in_(names))} if names else {}
+    for name in names - tags.keys():
+        tags[name] = Tag(name=name)
+
+    for news, news_names in items:
+        news_names = sorted(set(news_names))
+        news.tags = ';'.join(news_names)
+        news.tag_list = [tags[name] for name in news_names]
+
+
+def tagged_news_ids(names):
+    # ids of news that have all of the tags (intersection is made by sql using tags index)
+    names = set(names)
+    return sqlalchemy.select(news_tags.c.news_id) \
+        .join(Tag, Tag.id == news_tags.c.tag_id) \
+        .where(Tag.name.in_(names)) \
+        .group_by(news_tags.c.news_id) \
+        .having(sqlalchemy.func.count() == len(names))
+
+
+def migrate_tags(session):
+    # fill tags table from old ";" joined tags strings
+    from .news import News
+
+    for news in session.query(News).filter(News.tags != '', News.tags.isnot(None)):
+        set_news_tags(session, news, [i.strip() for i in news.tags.split(';') if i.strip() != ''])
+    session.commit()
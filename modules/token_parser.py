@@ -0,0 +1,5 @@
+from flask_restful import reqparse
+
+parser = reqparse.RequestParser()
+parser.add_argument('email', required=True)
+parser.add_argument('password', required=True)
@@ -0,0 +1,21 @@
+from flask_restful import abort, Resource
+from flask import current_app, jsonify
+
+from . import db_session
+from .user import User
+from .token_parser import parser
+from .api_auth import make_token
+
+
+class TokenResource(Resource):
+    def post(self):
+        # exchange email and password for api token (see api_auth.py)
+        args = parser.parse_args()
+        session = db_session.create_session()
+
+        user = session.query(User).filter(User.email == args['email']).first()
+        if user is None or user.hashed_password is None or not user.check_password(args['password']):
+            abort(401, message="wrong email or password")
+
+        return jsonify({'token': make_token(user), 'user_id': user.id,
+                        'expires_in': current_app.config['API_TOKEN_MAX_AGE']})
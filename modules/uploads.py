@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+# uploaded file is copied by pieces of this size, so whole file is never in memory
+CHUNK_SIZE = 64 * 1024
+
+# first bytes of the file -> real image type
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'BM', 'bmp')
+]
+
+
+class UploadError(Exception):
+    pass
+
+
+def detect_image_type(head):
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+def check_image(file, max_size):
+    """Check uploaded file without reading all of it.
+
+    returns real type of the image ("png", "jpg" or "bmp"), raises UploadError if it is not an image or too big
+    """
+    stream = file.stream
+    head = stream.read(16)
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+
+    ext = detect_image_type(head)
+    if ext is None:
+        raise UploadError('All files should be in png, jpg, jpeg or bmp format')
+    if size > max_size:
+        raise UploadError(f'Image "{file.filename}" is too big, max size is {max_size // (1024 * 1024)} MB')
+    return ext
+
+
+def save_image(file, path, max_size, digest=None):
+    # copy uploaded file to temporary file in the same folder by chunks and then atomically rename it,
+    # so nobody can see half-written image. If digest (hashlib object) is given it is updated with the file content
+    ext = check_image(file, max_size)
+
+    folder = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        written = 0
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                # size can be unknown for not seekable streams, so we check it again
+                if written > max_size:
+                    raise UploadError(f'Image "{file.filename}" is too big, max size is '
+                                      f'{max_size // (1024 * 1024)} MB')
+                f.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return ext
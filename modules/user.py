@@ -19,15 +19,37 @@ class User(SqlAlchemyBase, UserMixin, SerializerMixin):
     email = sqlalchemy.Column(sqlalchemy.String, index=True, unique=True, nullable=True)
 
     hashed_password = sqlalchemy.Column(sqlalchemy.String, nullable=True)
-    modified_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
+    modified_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now,
+                                      onupdate=datetime.datetime.now)
 
     # path to the profile picture
     image = sqlalchemy.Column(sqlalchemy.String, nullable=True, default='no_pfp.png')
 
-    news = orm.relationship("News", back_populates='creator')
+    # news are given to "deleted user" by one UPDATE before user is deleted, orm doesn't touch them
+    news = orm.relationship("News", back_populates='creator', passive_deletes='all')
 
     def set_password(self, password):
         self.hashed_password = generate_password_hash(password)
 
     def check_password(self, password):
         return check_password_hash(self.hashed_password, password)
+
+
+def remove_user(session, user):
+    # news go to "deleted user" by one UPDATE, comments are deleted by the database with the user.
+    # Caller commits
+    from .news import News
+    from .comment import Comment, update_comment_stats
+    from .blob import release_blob
+    from . import page_cache, user_cache
+
+    commented_news = [i.news_id for i in session.query(Comment.news_id).filter(Comment.creator_id == user.id)
+                      .distinct()]
+    session.query(News).filter(News.creator_id == user.id).update({News.creator_id: 1},
+                                                                  synchronize_session=False)
+    page_cache.invalidate_on_commit(session, {'user-news:1'})
+    user_cache.invalidate_on_commit(session, {user.id})
+
+    release_blob(session, user.image)
+    session.delete(user)
+    update_comment_stats(session, commented_news)
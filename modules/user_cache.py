@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from flask_login import UserMixin
+from sqlalchemy.orm import Session
+
+from . import db_session
+from .user import User
+
+# login_manager.user_loader is called on every request of a logged in user. Instead of selecting the user
+# every time, fields that pages need of current_user are kept in memory for USER_CACHE_TTL seconds.
+# Views that change or delete users call invalidate_on_commit, entries are removed when the session commits.
+# Other worker processes don't see our invalidations, they show old nickname or picture until ttl passes.
+
+
+class CachedUser(UserMixin):
+    """Logged in user for templates and views, it is not bound to any session.
+
+    It is equal to User with the same id (see UserMixin.__eq__), so "user == current_user" still works,
+    but queries need its id: News.creator_id == current_user.id
+    """
+
+    def __init__(self, id, nickname, image):
+        self.id = id
+        self.nickname = nickname
+        self.image = image
+
+
+class UserCache:
+    """LRU cache of CachedUser by id with max age of entries."""
+
+    def __init__(self, max_entries=0, ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # id -> (CachedUser, time it was put)
+        self.__entries = OrderedDict()
+        # changed on every invalidation, users loaded while something was invalidated are not stored
+        self.generation = 0
+        self.__lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, user_id):
+        with self.__lock:
+            entry = self.__entries.get(user_id)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self.__entries[user_id]
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.__entries.move_to_end(user_id)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, user, generation):
+        with self.__lock:
+            if generation != self.generation or not self.max_entries:
+                return
+            self.__entries[user.id] = (user, time.monotonic())
+            self.__entries.move_to_end(user.id)
+            # least recently used users are removed first
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def invalidate(self, user_ids):
+        with self.__lock:
+            self.generation += 1
+            for user_id in user_ids:
+                if self.__entries.pop(user_id, None) is not None:
+                    self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.generation += 1
+            self.__entries.clear()
+
+    def stats(self):
+        with self.__lock:
+            return dict(self.counters, entries=len(self.__entries), max_entries=self.max_entries)
+
+
+cache = UserCache()
+
+
+def init_app(app):
+    cache.max_entries = app.config['USER_CACHE_SIZE']
+    cache.ttl = app.config['USER_CACHE_TTL']
+    cache.clear()
+
+
+def load_user(user_id):
+    # for login_manager.user_loader, user_id is the string from the session cookie
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    user = cache.get(user_id)
+    if user is not None:
+        return user
+
+    generation = cache.generation
+    row = db_session.create_read_session().query(User.id, User.nickname, User.image) \
+        .filter(User.id == user_id).first()
+    if row is None:
+        return None
+    user = CachedUser(row.id, row.nickname, row.image)
+    cache.put(user, generation)
+    return user
+
+
+def invalidate_on_commit(session, user_ids):
+    # called by views that change nickname or picture of users or delete them
+    session.info.setdefault('user_cache_ids', set()).update(user_ids)
+
+
+@sa.event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    user_ids = session.info.pop('user_cache_ids', None)
+    if user_ids:
+        cache.invalidate(user_ids)
+
+
+@sa.event.listens_for(Session, 'after_rollback')
+def forget_rolled_back(session):
+    session.info.pop('user_cache_ids', None)
+
+
+def stats():
+    return cache.stats()
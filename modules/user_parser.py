@@ -5,3 +5,11 @@ parser.add_argument('nickname', required=True)
 parser.add_argument('email', required=True)
 parser.add_argument('password', required=True)
 parser.add_argument('about', required=False)
+
+# changing the user needs his password or his api token (see api_auth.py)
+update_parser = parser.copy()
+update_parser.replace_argument('password', required=False)
+
+# many users in one request: {"users": [{"nickname": ..., "email": ..., "password": ..., "about": ...}]}
+batch_parser = reqparse.RequestParser()
+batch_parser.add_argument('users', required=True, type=list, location='json')
@@ -1,11 +1,22 @@
 from flask_restful import reqparse, abort, Api, Resource
 from flask import jsonify, request
-from werkzeug.security import check_password_hash
 
 from . import db_session
-from .user import User
-from .comment import Comment
-from .user_parser import parser
+from . import user_cache
+from .user import User, remove_user
+from .user_parser import parser, update_parser, batch_parser
+from .api_auth import bearer_token, is_authorized
+from .batch import MAX_USER_BATCH_SIZE, check_batch_size, text_error
+from .list_api import parse_fields, parse_since, filter_query, list_response
+from .schema import Schema
+from .versions import table_versions, make_etag, not_modified, with_etag
+
+# fields that api gives for users and fields that are given by default (user page gives about too)
+USER_SCHEMA = Schema(User, {
+    'id': User.id, 'nickname': User.nickname, 'email': User.email, 'about': User.about, 'image': User.image,
+    'modified_date': User.modified_date
+})
+USER_DEFAULT_FIELDS = ('id', 'nickname', 'email')
 
 
 def abort_if_user_not_found(user_id):
@@ -13,54 +24,51 @@ def abort_if_user_not_found(user_id):
     users = session.query(User).get(user_id)
     if not users:
         abort(404, message=f"User with id {user_id} not found")
+    return users
 
 
 class UserResource(Resource):
     def get(self, user_id):
-        abort_if_user_not_found(user_id)
-        session = db_session.create_session()
-        user = session.query(User).get(user_id)
-        return jsonify({'users': user.to_dict(
-            only=('nickname', 'email', 'about', 'id'))})
+        session = db_session.create_read_session()
+        stamp = session.query(User.modified_date).filter(User.id == user_id).first()
+        if stamp is None:
+            abort(404, message=f"User with id {user_id} not found")
+
+        etag = make_etag(*stamp)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        return with_etag(jsonify({'users': USER_SCHEMA.first(session, ('nickname', 'email', 'about', 'id'),
+                                                             User.id == user_id)}), etag)
 
     def delete(self, user_id):
-        abort_if_user_not_found(user_id)
+        user = abort_if_user_not_found(user_id)
 
-        user_data = request.json
+        user_data = request.get_json(silent=True) or {}
 
-        if user_data.get('password', None) is None:
-            return abort(405, message=f'to delete user with id {user_id} send his password in json with "password" key')
+        if user_data.get('password', None) is None and bearer_token() is None:
+            return abort(405, message=f'to delete user with id {user_id} send his api token or his password '
+                                      f'in json with "password" key')
 
         session = db_session.create_session()
-        user = session.query(User).get(user_id)
 
-        if not check_password_hash(user.hashed_password, user_data['password']):
+        if not is_authorized(user, user_data.get('password')):
             return abort(405, message=f"password doesn't match user password, can't delete user with id {user_id}")
 
-        user_comments = session.query(Comment).filter(Comment.creator_id == user.id)
-        for com in user_comments:
-            session.delete(com)
-        session.commit()
-
-        for news in user.news:
-            news.creator_id = 1
-        session.commit()
-
-        session.delete(user)
+        remove_user(session, user)
         session.commit()
         return jsonify({'success': 'OK'})
 
     def put(self, user_id):
-        abort_if_user_not_found(user_id)
+        user = abort_if_user_not_found(user_id)
 
         session = db_session.create_session()
-        user = session.query(User).get(user_id)
 
-        args = parser.parse_args()
+        args = update_parser.parse_args()
 
         new_password = request.json.get('new_password', None)
 
-        if not check_password_hash(user.hashed_password, args['password']):
+        if not is_authorized(user, args['password']):
             abort(405, message=f"Password for user (id={user_id}) you're trying to change is not correct")
 
         user_e = session.query(User).filter(User.email == args['email']).first()
@@ -73,6 +81,7 @@ class UserResource(Resource):
         if new_password is not None:
             user.set_password(new_password)
 
+        user_cache.invalidate_on_commit(session, {user.id})
         session.commit()
         return jsonify({'success': 'OK', 'tip': 'send news password with key "new_password" '
                                                 'in json in order to change password'})
@@ -80,10 +89,16 @@ class UserResource(Resource):
 
 class UserListResource(Resource):
     def get(self):
-        session = db_session.create_session()
-        users = session.query(User).all()
-        return jsonify({'users': [item.to_dict(
-            only=('id', 'nickname', 'email')) for item in users]})
+        session = db_session.create_read_session()
+
+        etag = make_etag(table_versions(session, ('users',)))
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        fields = parse_fields(tuple(USER_SCHEMA.fields), USER_DEFAULT_FIELDS)
+        query = filter_query(USER_SCHEMA.query(session, fields), {'since': (User.modified_date, parse_since)})
+        return with_etag(list_response('users', USER_SCHEMA, query, fields), etag)
 
     def post(self):
         args = parser.parse_args()
@@ -93,8 +108,6 @@ class UserListResource(Resource):
         if user_e:
             abort(405, message=f'User with email {args["email"]} already exists')
 
-        print(args['about'])
-
         user = User(
             nickname=args['nickname'],
             about=args['about'] if args['about'] is not None else '',
@@ -105,3 +118,38 @@ class UserListResource(Resource):
         session.add(user)
         session.commit()
         return jsonify({'success': 'OK'})
+
+
+class UserBatchResource(Resource):
+    # registration of many users, at most MAX_USER_BATCH_SIZE in one request (passwords are hashed one by one)
+    def post(self):
+        args = batch_parser.parse_args()
+        check_batch_size(args['users'], MAX_USER_BATCH_SIZE)
+        session = db_session.create_session()
+
+        emails = [item.get('email') for item in args['users'] if isinstance(item, dict)]
+        taken = {row.email for row in session.query(User.email).filter(
+            User.email.in_([i for i in emails if isinstance(i, str)]))}
+
+        results, created = [], []
+        for index, item in enumerate(args['users']):
+            error = text_error(item, ('nickname', 'email', 'password'))
+            if error is None and item['email'] in taken:
+                error = f'User with email {item["email"]} already exists'
+            if error is None and not isinstance(item.get('about') or '', str):
+                error = '"about" should be string'
+            if error is not None:
+                results.append({'index': index, 'error': error})
+                continue
+
+            user = User(nickname=item['nickname'], email=item['email'], about=item.get('about') or '')
+            user.set_password(item['password'])
+            created.append((index, user))
+            taken.add(item['email'])
+
+        # all users are inserted by one flush
+        session.add_all([user for _, user in created])
+        session.flush()
+        results += [{'index': index, 'id': user.id} for index, user in created]
+        session.commit()
+        return jsonify({'success': 'OK', 'results': sorted(results, key=lambda x: x['index'])})
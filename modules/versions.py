@@ -0,0 +1,60 @@
+import hashlib
+
+import sqlalchemy
+from flask import request, Response
+
+from .db_session import SqlAlchemyBase
+
+# Api answers have ETags, client sends it back in If-None-Match and gets 304 if nothing changed.
+# One item ETag is made from its updated_at (modified_date for users), list ETag - from versions of tables
+# the list is made of. Version of a table is increased by triggers on every insert, update and delete,
+# so bulk statements and other processes writing to the database are counted too
+VERSIONED_TABLES = ('news', 'comments', 'users')
+
+
+class TableVersion(SqlAlchemyBase):
+    __tablename__ = 'table_versions'
+
+    name = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    version = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
+
+
+def version_triggers(table):
+    return [f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event} AFTER {event.upper()} ON {table} BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END""" for event in ('insert', 'update', 'delete')]
+
+
+def create_versions(engine):
+    with engine.begin() as conn:
+        for table in VERSIONED_TABLES:
+            conn.exec_driver_sql(f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{table}', 0)")
+            for statement in version_triggers(table):
+                conn.exec_driver_sql(statement)
+        # rows that were there before updated_at appeared
+        conn.exec_driver_sql("UPDATE news SET updated_at = creation_date WHERE updated_at IS NULL")
+        conn.exec_driver_sql("UPDATE comments SET updated_at = creation_date WHERE updated_at IS NULL")
+
+
+def table_versions(session, tables):
+    return session.query(TableVersion.name, TableVersion.version).filter(TableVersion.name.in_(tables)).all()
+
+
+def make_etag(*parts):
+    # strong ETag of the answer: what it is made of and arguments of the request (fields, filters, pages)
+    text = repr((parts, request.path, request.query_string, request.accept_mimetypes.to_header()))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def not_modified(etag):
+    # 304 answer if client already has this version, else None
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    return response
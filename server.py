@@ -1,5 +1,5 @@
 # flask
-from flask import Flask, redirect, request, render_template, url_for, abort, jsonify, make_response
+from flask import Flask, Blueprint, current_app, redirect, request, render_template, url_for, abort, jsonify, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 
@@ -8,50 +8,216 @@ from modules.forms import RegisterForm, LoginForm, NewsForm, DeleteForm, Comment
 
 # modules
 from modules import db_session
-from modules.user import User
+from modules import static_assets
+from modules import page_cache
+from modules import user_cache
+from modules import metrics
+from modules.user import User, remove_user
 from modules.news import News
-from modules.comment import Comment
+from modules.comment import Comment, update_comment_stats, recount_comments
+from modules.pagination import paginate_news, parse_cursor
+from modules.tag import parse_tags, set_news_tags, tagged_news_ids
+from modules.news_search import search_news
+from modules.images import image_urls, user_image_urls, news_first_image, backfill_variants, blob_path, \
+    user_image_path, BLOB_FOLDER
+from modules.uploads import UploadError, check_image
+from modules.blob import store_image, release_blob
 
 # other
+from sqlalchemy import orm
 import os
 import datetime
-import shutil
+import click
 
 # api
 from flask_restful import Api
 from modules import users_resource
 from modules import news_resource
 from modules import comment_resource
+from modules import token_resource
 
 from dotenv import load_dotenv
 
 load_dotenv('.env')
 
-app = Flask(__name__)
+# pages, cli commands and error handlers, create_app registers them on the app
+pages = Blueprint('pages', __name__, cli_group=None)
 
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', '4ZhikxdLR2DdeqOjc7Jr1vHRYI6svo')
+login_manager = LoginManager()
 
-api = Api(app)
 
-login_manager = LoginManager()
-login_manager.init_app(app)
+def create_app(config=None):
+    """Make the application: pages, api resources, login manager and database.
+
+    config - settings over the ones from environment, like {'DB_FILE': 'bench.db'}.
+    Database is initialized once per process (see db_session.global_init), its pools are made again
+    in processes forked after it, so the app can be created before gunicorn forks workers (see wsgi.py).
+    Its schema is not checked here, so cli commands (init-db) work on old databases too,
+    main and wsgi.py check it
+    """
+    app = Flask(__name__)
+
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', '4ZhikxdLR2DdeqOjc7Jr1vHRYI6svo')
+    # how many news are shown on one page of main page and search results
+    app.config['NEWS_PAGE_SIZE'] = int(os.getenv('NEWS_PAGE_SIZE', 32))
+    # database file (benchmarks run the server on a seeded copy, see benchmarks/seed.py)
+    app.config['DB_FILE'] = os.getenv('DB_FILE', 'db/data.db')
+    # database connection pool
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 3600))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    # sqlite pragmas profile (see db_session.SQLITE_PROFILES), single pragmas can be changed with
+    # DB_PRAGMAS="busy_timeout=10000,cache_size=-2000"
+    app.config['DB_PRAGMAS'] = db_session.sqlite_pragmas(os.getenv('DB_PROFILE', 'production'), os.getenv('DB_PRAGMAS', ''))
+    # apply new migrations at start instead of "flask --app server init-db" (temporary databases of benchmarks)
+    app.config['DB_MIGRATE'] = os.getenv('DB_MIGRATE', '0') == '1'
+    # size of separate connection pool for read only pages (0 - they use the main pool)
+    app.config['DB_READ_POOL_SIZE'] = int(os.getenv('DB_READ_POOL_SIZE', 5))
+    # background threads that make downsized copies of uploaded images
+    app.config['IMAGE_WORKERS'] = int(os.getenv('IMAGE_WORKERS', 2))
+    # max size of whole request and of one uploaded image (bytes)
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 32 * 1024 * 1024))
+    app.config['MAX_IMAGE_SIZE'] = int(os.getenv('MAX_IMAGE_SIZE', 10 * 1024 * 1024))
+    # memory for rendered pages of anonymous users (bytes, 0 - no cache) and max age of them (seconds, 0 - no limit)
+    app.config['PAGE_CACHE_SIZE'] = int(os.getenv('PAGE_CACHE_SIZE', 32 * 1024 * 1024))
+    app.config['PAGE_CACHE_TTL'] = int(os.getenv('PAGE_CACHE_TTL', 300))
+    # with several worker processes a page cached by one of them is checked against table versions,
+    # so changes made by other processes are seen too (wsgi.py turns it on)
+    app.config['PAGE_CACHE_CHECK_VERSIONS'] = os.getenv('PAGE_CACHE_CHECK_VERSIONS', '0') == '1'
+    # logged in users kept in memory instead of selecting them on every request (entries, 0 - no cache)
+    # and max age of them (seconds), other worker processes see changes of users after it
+    app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 1000))
+    app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))
+    # request counters and timings served by /metrics, cheap enough to be always on
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '1') == '1'
+    # development and canary mode that logs queries made in loops and slow queries (see modules/query_check.py):
+    # same statement QUERY_CHECK_REPEATS times in one request or longer than QUERY_CHECK_SLOW_MS,
+    # problems go to QUERY_CHECK_LOG (json lines, stdout if empty), QUERY_CHECK_STRICT=1 makes such requests fail
+    app.config['QUERY_CHECK'] = os.getenv('QUERY_CHECK', '0') == '1'
+    app.config['QUERY_CHECK_REPEATS'] = int(os.getenv('QUERY_CHECK_REPEATS', 5))
+    app.config['QUERY_CHECK_SLOW_MS'] = float(os.getenv('QUERY_CHECK_SLOW_MS', 100))
+    app.config['QUERY_CHECK_LOG'] = os.getenv('QUERY_CHECK_LOG', '')
+    app.config['QUERY_CHECK_STRICT'] = os.getenv('QUERY_CHECK_STRICT', '0') == '1'
+    # api tokens lifetime (seconds)
+    app.config['API_TOKEN_MAX_AGE'] = int(os.getenv('API_TOKEN_MAX_AGE', 24 * 60 * 60))
+    app.config.update(config or {})
+
+    app.register_blueprint(pages)
+    register_api(app)
+    login_manager.init_app(app)
+
+    # one database session per request, closed when request ends
+    app.teardown_appcontext(db_session.close_session)
+
+    # templates use it for current user picture
+    app.add_template_global(user_image_urls)
+
+    # static urls with content hash and long cache for them
+    static_assets.init_app(app)
+
+    # rendered pages for anonymous users, they are removed when shown data changes
+    page_cache.init_app(app)
+
+    # current_user of logged in users, they are removed when users are changed
+    user_cache.init_app(app)
+
+    # latency, sql statements and template time of every request for /metrics
+    metrics.init_app(app)
+
+    if app.config['QUERY_CHECK']:
+        from modules.query_check import QueryChecker
+
+        query_checker = QueryChecker(slow_ms=app.config['QUERY_CHECK_SLOW_MS'],
+                                     max_repeats=app.config['QUERY_CHECK_REPEATS'],
+                                     log_file=app.config['QUERY_CHECK_LOG'] or None,
+                                     strict=app.config['QUERY_CHECK_STRICT'])
+        query_checker.init_app(app)
+        app.extensions['query_checker'] = query_checker
+
+    init_db(app)
+    if app.config['DB_MIGRATE']:
+        # old images are moved by migrations to the static folder of the app
+        with app.app_context():
+            db_session.apply_migrations()
+    return app
+
+
+def register_api(app):
+    api = Api(app)
+
+    api.add_resource(users_resource.UserResource, '/api/users/<int:user_id>')
+    api.add_resource(users_resource.UserListResource, '/api/users')
+    api.add_resource(users_resource.UserBatchResource, '/api/users/batch')
+
+    api.add_resource(news_resource.NewsResource, '/api/news/<int:news_id>')
+    api.add_resource(news_resource.NewsListResource, '/api/news')
+    api.add_resource(news_resource.NewsBatchResource, '/api/news/batch')
+
+    api.add_resource(comment_resource.CommentResource, '/api/comments/<int:com_id>')
+    api.add_resource(comment_resource.CommentListResource, '/api/comments')
+    api.add_resource(comment_resource.CommentBatchResource, '/api/comments/batch')
+
+    # password -> api token
+    api.add_resource(token_resource.TokenResource, '/api/tokens')
+
+
+def init_db(app):
+    # connect to the database, does nothing if it is done already. Its schema is not changed here,
+    # migrations are applied by "flask --app server init-db" or with DB_MIGRATE
+    db_session.global_init(app.config['DB_FILE'], pragmas=app.config['DB_PRAGMAS'],
+                           read_pool_size=app.config['DB_READ_POOL_SIZE'], pool_size=app.config['DB_POOL_SIZE'],
+                           max_overflow=app.config['DB_MAX_OVERFLOW'], pool_recycle=app.config['DB_POOL_RECYCLE'],
+                           pool_timeout=app.config['DB_POOL_TIMEOUT'],
+                           query_checker=app.extensions.get('query_checker'))
+
+
+def news_page_context(query):
+    # one page of news (for main_page.html) with links to older and newer pages
+    cursors = {}
+    for key in ('after', 'before'):
+        if request.args.get(key) is not None:
+            cursors[key] = parse_cursor(request.args[key])
+            if cursors[key] is None:
+                abort(400)
+
+    news, older_cursor, newer_cursor = paginate_news(query, current_app.config['NEWS_PAGE_SIZE'], **cursors)
+    page_cache.add_tags('news', *[f'news:{i.id}' for i in news])
+
+    first_images = {}
+    for i in news:
+        first_images[i.id] = news_first_image(i)
+
+    return {
+        'news': news,
+        'first_images': first_images,
+        'older_url': url_for(request.endpoint, **request.view_args, after=older_cursor) if older_cursor else None,
+        'newer_url': url_for(request.endpoint, **request.view_args, before=newer_cursor) if newer_cursor else None
+    }
+
+
+def uploaded_images(fields):
+    # not empty uploaded images of the form {field: (file, real image type)}, raises UploadError for wrong files
+    images = {}
+    for field in fields:
+        file = request.files.get(field)
+        if file is not None and secure_filename(file.filename) != '':
+            images[field] = file, check_image(file, current_app.config['MAX_IMAGE_SIZE'])
+    return images
 
 
 # routes
-@app.route('/')
+@pages.route('/')
+@page_cache.cached
 def main_page():
-    db_sess = db_session.create_session()
-    news = db_sess.query(News).all()
-    first_images_urls = {}
-    for i in news:
-        first_images_urls[i.id] = url_for('static', filename=f'img/news/{i.id}/{i.images.split(";")[0]}')
+    db_sess = db_session.create_read_session()
     return render_template('main_page.html', title='main page',
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/main_page.css'),
-                           news=news, first_images_urls=first_images_urls)
+                           **news_page_context(db_sess.query(News)))
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@pages.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
@@ -68,12 +234,13 @@ def register():
                                    page_css=url_for('static', filename='css/form.css'),
                                    form=form, message='user with that email already exists')
 
-        filename = secure_filename(request.files['file_pfp'].filename)
-        if filename != '' and filename.split(".")[-1] not in ('png', 'jpg', 'jpeg', 'bmp'):
+        try:
+            pfp = uploaded_images(['file_pfp'])
+        except UploadError as error:
             return render_template('register.html', title='register',
                                    base_css=url_for('static', filename='css/base.css'),
                                    page_css=url_for('static', filename='css/form.css'), form=form,
-                                   message='Profile picture should be in png, jpg, jpeg or bmp format')
+                                   message=str(error))
 
         user = User()
         user.nickname, user.email, user.about = form.nickname.data, form.email.data, form.about.data
@@ -82,13 +249,10 @@ def register():
         db_sess.add(user)
         db_sess.commit()
 
-        filename = secure_filename(request.files['file_pfp'].filename)
-        if filename != '':
-            with open(f'static/img/users/{user.id}.{filename.split(".")[-1]}', mode='wb') as f:
-                # if file is added we save it in news folder
-                f.writelines(request.files['file_pfp'].readlines())
-                user.image = f'{user.id}.{filename.split(".")[-1]}'
-                db_sess.commit()
+        if 'file_pfp' in pfp:
+            # if file is added we save it in images storage
+            user.image = store_image(db_sess, pfp['file_pfp'][0], current_app.config['MAX_IMAGE_SIZE'])
+            db_sess.commit()
 
         return redirect('/login')
     return render_template('register.html', title='register',
@@ -96,7 +260,7 @@ def register():
                            page_css=url_for('static', filename='css/form.css'), form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@pages.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
@@ -118,31 +282,31 @@ def login():
 
 @login_manager.user_loader
 def load_user(user_id):
-    db_sess = db_session.create_session()
-    return db_sess.query(User).get(user_id)
+    # user_cache.CachedUser, not bound to the session of the request
+    return user_cache.load_user(user_id)
 
 
 @login_required
-@app.route('/logout')
+@pages.route('/logout')
 def logout():
     logout_user()
     return redirect('/')
 
 
 @login_required
-@app.route('/news/add', methods=['GET', 'POST'])
+@pages.route('/news/add', methods=['GET', 'POST'])
 def add_news():
     form = NewsForm()
     if form.validate_on_submit():
         db_sess = db_session.create_session()
 
-        for file in request.files.keys():
-            filename = secure_filename(request.files[file].filename)
-            if filename != '' and filename.split(".")[-1] not in ('png', 'jpg', 'jpeg', 'bmp'):
-                return render_template('add_news.html', title='add news',
-                                       base_css=url_for('static', filename='css/base.css'),
-                                       page_css=url_for('static', filename='css/form.css'),
-                                       form=form, message='All files should be in png, jpg, jpeg or bmp format')
+        try:
+            uploaded = uploaded_images(['file_1', 'file_2', 'file_3'])
+        except UploadError as error:
+            return render_template('add_news.html', title='add news',
+                                   base_css=url_for('static', filename='css/base.css'),
+                                   page_css=url_for('static', filename='css/form.css'),
+                                   form=form, message=str(error))
 
         if form.tags.data != '' and form.tags.data[0] != '#':
             return render_template('add_news.html', title='add news',
@@ -155,38 +319,16 @@ def add_news():
             about=form.about.data
         )
 
-        # tags
-        news.tags = ';'.join(f' {form.tags.data}'.split(' #'))[1:] if len(form.tags.data) > 1 else ''
-        # without repeat
-        tags = set([i.strip() for i in news.tags.split(';')])
-        print(news.tags)
-        print(tags)
-        news.tags = ';'.join(sorted(list(tags)))
+        # tags (without repeat)
+        set_news_tags(db_sess, news, parse_tags(form.tags.data))
 
-        # we add the news so we can have the id and make files folder
         news.creator_id = current_user.id
-        db_sess.add(news)
-        db_sess.commit()
-
-        # make a folder with name - id of added news
-        if os.path.exists(f'static/img/news/{news.id}'):
-            shutil.rmtree(f'static/img/news/{news.id}')
-        os.makedirs(f'static/img/news/{news.id}')
 
-        # images names
-        images = []
-
-        # we take all uploaded files and save them at news folder
-        for file in request.files.keys():
-            filename = secure_filename(request.files[file].filename)
-            if filename != '':
-                with open(f'static/img/news/{news.id}/{filename}', mode='wb') as f:
-                    # if file is added we save it in news folder with picture number as name
-                    f.writelines(request.files[file].readlines())
-                images.append(filename)
-
-        news.images = ';'.join(images)
+        # we take all uploaded files and save them at images storage
+        news.images = ';'.join(store_image(db_sess, file, current_app.config['MAX_IMAGE_SIZE'])
+                               for file, _ in uploaded.values())
 
+        db_sess.add(news)
         db_sess.commit()
         return redirect('/')
     return render_template('add_news.html', title='add news',
@@ -196,21 +338,21 @@ def add_news():
 
 
 @login_required
-@app.route('/news/edit/<int:id>', methods=['GET', 'POST'])
+@pages.route('/news/edit/<int:id>', methods=['GET', 'POST'])
 def edit_news(id):
     form = NewsForm()
 
     if request.method == 'GET':
         # fill the form with already existing data
         db_sess = db_session.create_session()
-        news = db_sess.query(News).filter(News.id == id, News.creator == current_user).first()
+        news = db_sess.query(News).filter(News.id == id, News.creator_id == current_user.id).first()
         if not news:
             abort(404)
         else:
             # fill the form
             form.title.data = news.title
             form.about.data = news.about
-            form.tags.data = news.tags
+            form.tags.data = ' '.join(f'#{tag}' for tag in news.tags.split(';') if tag != '')
 
     if form.validate_on_submit():
         # edit the news
@@ -220,19 +362,19 @@ def edit_news(id):
             abort(404)
 
         # check if all uploaded files are images
-        for file in request.files.keys():
-            filename = secure_filename(request.files[file].filename)
-            if filename != '' and filename.split(".")[-1] not in ('png', 'jpg', 'jpeg', 'bmp'):
-                return render_template('edit_news.html', title='edit news',
-                                       base_css=url_for('static', filename='css/base.css'),
-                                       page_css=url_for('static', filename='css/form.css'),
-                                       form=form, message='All files should be in png, jpg, jpeg or bmp format',
-                                       imgs_urls=[url_for('static', filename=f'img/news/{news.id}/{i}')
-                                                  for i in news.images.split(';')])
+        try:
+            uploaded = uploaded_images(['file_1', 'file_2', 'file_3'])
+        except UploadError as error:
+            return render_template('edit_news.html', title='edit news',
+                                   base_css=url_for('static', filename='css/base.css'),
+                                   page_css=url_for('static', filename='css/form.css'),
+                                   form=form, message=str(error),
+                                   imgs_urls=[url_for('static', filename=blob_path(i))
+                                              for i in news.images.split(';') if i != ''])
 
         news.title = form.title.data
         news.about = form.about.data
-        news.tags = form.tags.data
+        set_news_tags(db_sess, news, parse_tags(form.tags.data))
 
         # edit files
         images = news.images.split(';')
@@ -240,48 +382,24 @@ def edit_news(id):
 
         # if user wants to delete already existing file
         if form.file_1_ignore.data and images[0] != '':
-            try:
-                os.remove(f'static/img/news/{news.id}/{images[0]}')
-            except FileNotFoundError:
-                pass
+            release_blob(db_sess, images[0])
             images[0] = ''
         if form.file_2_ignore.data and images[1] != '':
-            try:
-                os.remove(f'static/img/news/{news.id}/{images[1]}')
-            except FileNotFoundError:
-                pass
+            release_blob(db_sess, images[1])
             images[1] = ''
         if form.file_3_ignore.data and images[2] != '':
-            try:
-                os.remove(f'static/img/news/{news.id}/{images[2]}')
-            except FileNotFoundError:
-                pass
+            release_blob(db_sess, images[2])
             images[2] = ''
 
-        for file in request.files.keys():
-            filename = secure_filename(request.files[file].filename)
-
-            if filename != '':
-                with open(f'static/img/news/{news.id}/{filename}', mode='wb') as f:
-                    # if file is added we save it in news folder
-                    # and we delete old file
-
-                    if form.file_1_ignore.data:
-                        images[0] = ''
-                        continue
-                    if form.file_2_ignore.data:
-                        images[1] = ''
-                        continue
-                    if form.file_3_ignore.data:
-                        images[2] = ''
-                        continue
-
-                    f.writelines(request.files[file])
-                    images[int(file[-1]) - 1] = filename
+        for number, field in enumerate(['file_1', 'file_2', 'file_3']):
+            # if file is added we save it in news folder and we delete old file
+            # (if user checked "delete" box for this image, new file is ignored)
+            if field not in uploaded or getattr(form, f'{field}_ignore').data:
+                continue
 
-                news.images = ';'.join(list(filter(lambda x: x != '', images)))
-
-        # if user wants to delete already existing file
+            blob_id = store_image(db_sess, uploaded[field][0], current_app.config['MAX_IMAGE_SIZE'])
+            release_blob(db_sess, images[number])
+            images[number] = blob_id
 
         news.images = ';'.join(list(filter(lambda x: x != '', images)))
 
@@ -290,32 +408,25 @@ def edit_news(id):
     return render_template('edit_news.html', title='edit news',
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/form.css'),
-                           form=form, imgs_urls=[url_for('static', filename=f'img/news/{news.id}/{i}')
-                                                  for i in news.images.split(';')])
+                           form=form, imgs_urls=[url_for('static', filename=blob_path(i))
+                                                  for i in news.images.split(';') if i != ''])
 
 
 @login_required
-@app.route('/news/delete/<int:id>', methods=['GET', 'POST'])
+@pages.route('/news/delete/<int:id>', methods=['GET', 'POST'])
 def delete_news(id):
     form = DeleteForm()
 
     db_sess = db_session.create_session()
-    news = db_sess.query(News).filter(News.id == id, News.creator == current_user).first()
+    news = db_sess.query(News).filter(News.id == id, News.creator_id == current_user.id).first()
     if not news:
         abort(404)
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
-        news = db_sess.query(News).filter(News.id == id, News.creator == current_user).first()
-        if not news:
-            abort(404)
-
-        shutil.rmtree(f'static/img/news/{news.id}')
-
-        for com in news.comments:
-            db_sess.delete(com)
-        db_sess.commit()
+        for blob_id in news.images.split(';'):
+            release_blob(db_sess, blob_id)
 
+        # comments and tags links are deleted by the database (ON DELETE CASCADE)
         db_sess.delete(news)
         db_sess.commit()
         return redirect('/')
@@ -323,77 +434,82 @@ def delete_news(id):
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/form.css'),
                            form=form, news=news,
-                           img_url=url_for('static',
-                                           filename=f'img/news/{news.id}/{news.images.split(";")[0]}'
-                                           if news.images else ''))
+                           img_url=news_first_image(news)['src'])
 
 
 @login_required
-@app.route('/news/<int:id>', methods=['GET', 'POST'])
+@pages.route('/news/<int:id>', methods=['GET', 'POST'])
+@page_cache.cached
 def news_show(id):
     form = CommentForm()
-    db_sess = db_session.create_session()
-    news = db_sess.query(News).get(id)
-    if not news:
-        abort(404)
-
-    # data about commentators
-    comments_creators_dict = {}
-    for i in news.comments:
-        user = db_sess.query(User).filter(User.id == i.creator_id).first()
-        if user:
-            comments_creators_dict[i.id] = user
-
-    # comments users images
-    comments_creators_imgs_urls = {}
-    for i in news.comments:
-        comments_creators_imgs_urls[i.id] = \
-            url_for('static', filename=f'img/users/{comments_creators_dict[i.id].image}')
-
-    # news images
-    news_images_url = [url_for('static', filename=f'img/news/{id}/{i}') for i in news.images.split(';')]
 
     if form.validate_on_submit():
+        db_sess = db_session.create_session()
+        if not db_sess.query(News.id).filter(News.id == id).first():
+            abort(404)
+
         comment = Comment(
             text=form.text.data,
             creator_id=current_user.id,
             news_id=id
         )
-        db_sess = db_session.create_session()
         db_sess.add(comment)
+        update_comment_stats(db_sess, [id])
         db_sess.commit()
         return redirect(f'/news/{id}')
+
+    # news with its creator, comments and comments creators in two queries
+    db_sess = db_session.create_session()
+    news = db_sess.query(News).filter(News.id == id).options(
+        orm.joinedload(News.creator),
+        orm.selectinload(News.comments).joinedload(Comment.creator)
+    ).first()
+    if not news:
+        abort(404)
+    page_cache.add_tags(f'news:{id}', f'comments:{id}', f'user:{news.creator_id}',
+                        *[f'user:{i.creator_id}' for i in news.comments])
+
+    # comments users images
+    comments_creators_imgs = {}
+    for i in news.comments:
+        comments_creators_imgs[i.id] = user_image_urls(i.creator.image)
+
+    # news images
+    news_images = [image_urls(blob_path(i)) for i in news.images.split(';') if i != '']
+
     return render_template('one_news_show.html', title='news',
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/one_news_page.css'),
-                           form=form, comments_creators_dict=comments_creators_dict, news=news,
-                           news_images_url=news_images_url,
-                           creator_img_url=url_for('static', filename=f'img/users/{news.creator.image}'),
-                           comments_creators_imgs_urls=comments_creators_imgs_urls,
+                           form=form, news=news,
+                           news_images=news_images,
+                           creator_img=user_image_urls(news.creator.image),
+                           comments_creators_imgs=comments_creators_imgs,
                            comments=sorted(news.comments, key=lambda x: x.creation_date, reverse=True))
 
 
-@app.route('/user/profile/<int:id>', methods=['GET', 'POST'])
+@pages.route('/user/profile/<int:id>', methods=['GET', 'POST'])
+@page_cache.cached
 def show_user(id):
     db_sess = db_session.create_session()
     user = db_sess.query(User).get(id)
     if not user:
         abort(404)
+    page_cache.add_tags(f'user:{id}', f'user-news:{id}', *[f'news:{i.id}' for i in user.news])
 
-    first_images_urls = {}
+    first_images = {}
     for i in user.news:
-        first_images_urls[i.id] = url_for('static', filename=f'img/news/{i.id}/{i.images.split(";")[0]}')
+        first_images[i.id] = news_first_image(i)
 
     return render_template('profile.html', title='profile',
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/profile_page.css'),
-                           user_img_url=url_for('static', filename=f'img/users/{user.image}'),
-                           user=user, first_images_urls=first_images_urls,
+                           user_img=user_image_urls(user.image),
+                           user=user, first_images=first_images,
                            user_news=sorted(user.news, key=lambda x: x.creation_date, reverse=True))
 
 
 @login_required
-@app.route('/user/profile/delete/<int:id>', methods=['GET', 'POST'])
+@pages.route('/user/profile/delete/<int:id>', methods=['GET', 'POST'])
 def delete_user(id):
     form = DeleteForm()
     db_sess = db_session.create_session()
@@ -402,31 +518,18 @@ def delete_user(id):
         abort(404)
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
-        user = db_sess.query(User).filter(User.id == id, User.id == current_user.id).first()
-        if not user:
-            abort(404)
-
-        for news in user.news:
-            news.creator_id = 1
-        db_sess.commit()
-
-        user_comments = db_sess.query(Comment).filter(Comment.creator_id == user.id)
-        for comment in user_comments:
-            db_sess.delete(comment)
-
-        db_sess.delete(user)
+        remove_user(db_sess, user)
         db_sess.commit()
         logout_user()
         return redirect('/')
     return render_template('delete_user.html', title='delete user',
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/form.css'),
-                           form=form, user=user, user_pfp_url=url_for('static', filename=f'img/users/{user.image}'))
+                           form=form, user=user, user_pfp_url=url_for('static', filename=user_image_path(user.image)))
 
 
 @login_required
-@app.route('/user/profile/edit/<int:id>', methods=['GET', 'POST'])
+@pages.route('/user/profile/edit/<int:id>', methods=['GET', 'POST'])
 def edit_user(id):
     form = EditUserForm()
 
@@ -455,12 +558,13 @@ def edit_user(id):
                                    form=form, message='Passwords should match')
 
         # if prfile picture (pfp) is in wrong format we tell user about it
-        filename = secure_filename(request.files['file_pfp'].filename)
-        if filename != '' and filename.split(".")[-1] not in ('png', 'jpg', 'jpeg', 'bmp'):
+        try:
+            pfp = uploaded_images(['file_pfp'])
+        except UploadError as error:
             return render_template('edit_user.html', title='edit user',
                                    base_css=url_for('static', filename='css/base.css'),
                                    page_css=url_for('static', filename='css/form.css'),
-                                   form=form, message='Profile picture should be in png, jpg, jpeg or bmp format')
+                                   form=form, message=str(error))
 
         user.nickname = form.nickname.data
         user.about = form.about.data
@@ -470,25 +574,18 @@ def edit_user(id):
             user.set_password(form.password.data)
 
         # if file is here we update pfp
-        if filename != '':
-            try:
-                os.remove(f'static/img/users/{user.image}')
-            except FileNotFoundError:
-                pass
-            with open(f'static/img/users/{user.id}.{filename.split(".")[-1]}', mode='wb') as f:
-                # if file is added we save it in news folder
-                # and we delete old file
-                f.writelines(request.files['file_pfp'].readlines())
-                user.image = f'{user.id}.{filename.split(".")[-1]}'
+        if 'file_pfp' in pfp:
+            # if file is added we save it in images storage and we release old one
+            blob_id = store_image(db_sess, pfp['file_pfp'][0], current_app.config['MAX_IMAGE_SIZE'])
+            release_blob(db_sess, user.image)
+            user.image = blob_id
 
         # if user wants to delete pfp and box is checked we delete the file
         if form.ignore_pfp.data:
-            try:
-                os.remove(f'static/img/users/{user.image}')
-            except FileNotFoundError:
-                pass
+            release_blob(db_sess, user.image)
             user.image = 'no_pfp.png'
 
+        user_cache.invalidate_on_commit(db_sess, {user.id})
         db_sess.commit()
         return redirect(f'/user/profile/{user.id}')
     return render_template('edit_user.html', title='edit user',
@@ -498,7 +595,7 @@ def edit_user(id):
 
 
 @login_required
-@app.route('/comments/delete/<int:id>', methods=['GET', 'POST'])
+@pages.route('/comments/delete/<int:id>', methods=['GET', 'POST'])
 def delete_comment(id):
     form = DeleteForm()
     db_sess = db_session.create_session()
@@ -507,14 +604,10 @@ def delete_comment(id):
         abort(404)
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
-        comment = db_sess.query(Comment).filter(Comment.id == id, Comment.creator_id == current_user.id).first()
-        if not comment:
-            abort(404)
-
         news_id = comment.news.id
 
         db_sess.delete(comment)
+        update_comment_stats(db_sess, [news_id])
         db_sess.commit()
         return redirect(f'/news/{news_id}')
     return render_template('delete_comment.html', title='delete comment',
@@ -524,7 +617,7 @@ def delete_comment(id):
 
 
 @login_required
-@app.route('/comments/edit/<int:id>', methods=['GET', 'POST'])
+@pages.route('/comments/edit/<int:id>', methods=['GET', 'POST'])
 def edit_comment(id):
     form = CommentForm()
     db_sess = db_session.create_session()
@@ -536,14 +629,10 @@ def edit_comment(id):
         form.text.data = comment.text
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
-        comment = db_sess.query(Comment).filter(Comment.id == id, Comment.creator_id == current_user.id).first()
-        if not comment:
-            abort(404)
-
         comment.text = form.text.data
         comment.creation_date = datetime.datetime.now()
         comment.is_edited = True
+        update_comment_stats(db_sess, [comment.news_id])
 
         db_sess.commit()
         return redirect(f'/news/{comment.news.id}')
@@ -553,7 +642,7 @@ def edit_comment(id):
                            form=form, comment=comment)
 
 
-@app.route('/news/search', methods=['GET', 'POST'])
+@pages.route('/news/search', methods=['GET', 'POST'])
 def search_tagged_news_form():
     form = CommentForm()
 
@@ -565,51 +654,108 @@ def search_tagged_news_form():
                            form=form)
 
 
-@app.route('/news/search/<tags>', methods=['GET', 'POST'])
+@pages.route('/news/search/<tags>', methods=['GET', 'POST'])
 def search_tagged_news(tags):
-    db_sess = db_session.create_session()
+    db_sess = db_session.create_read_session()
 
     # find tagged news
-    news = list(filter(lambda x: all([tag in x.tags.split(';') for tag in tags.split(';')]), db_sess.query(News).all()))
+    tags = [tag for tag in tags.split(';') if tag != '']
+    query = db_sess.query(News).filter(News.id.in_(tagged_news_ids(tags)))
 
     # same with main page
-    first_images_urls = {}
-    for i in news:
-        first_images_urls[i.id] = url_for('static', filename=f'img/news/{i.id}/{i.images.split(";")[0]}')
-
     return render_template('main_page.html', title='main page',
                            base_css=url_for('static', filename='css/base.css'),
                            page_css=url_for('static', filename='css/main_page.css'),
-                           news=news, first_images_urls=first_images_urls)
+                           **news_page_context(query))
 
 
-@app.errorhandler(400)
-def bad_request(error):
-    return make_response(jsonify({'error': 'Bad request'}), 400)
+@pages.route('/news/find')
+def find_news():
+    text = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    page_size = current_app.config['NEWS_PAGE_SIZE']
 
+    db_sess = db_session.create_read_session()
+    # we take one more to know if there is next page
+    results = search_news(db_sess, text, page_size + 1, (page - 1) * page_size) if text and page > 0 else []
 
-def main():
-    db_session.global_init('db/data.db')
+    first_images = {}
+    for i, _, _ in results:
+        first_images[i.id] = news_first_image(i)
 
-    db_sess_first = db_session.create_session()
-    if db_sess_first.query(User).get(1) is None:
-        user = User(
-            nickname='deleted user',
-            image='dead_user.png'
-        )
-        db_sess_first.add(user)
-        db_sess_first.commit()
-    
-    # api
-    api.add_resource(users_resource.UserResource, '/api/users/<int:user_id>')
-    api.add_resource(users_resource.UserListResource, '/api/users')
+    return render_template('news_find.html', title='find news',
+                           base_css=url_for('static', filename='css/base.css'),
+                           page_css=url_for('static', filename='css/main_page.css'),
+                           text=text, results=results[:page_size], first_images=first_images,
+                           prev_url=url_for('.find_news', q=text, page=page - 1) if page > 1 else None,
+                           next_url=url_for('.find_news', q=text, page=page + 1)
+                           if len(results) > page_size else None)
 
-    api.add_resource(news_resource.NewsResource, '/api/news/<int:news_id>')
-    api.add_resource(news_resource.NewsListResource, '/api/news')
 
-    api.add_resource(comment_resource.CommentResource, '/api/comments/<int:com_id>')
-    api.add_resource(comment_resource.CommentListResource, '/api/comments')
+@pages.route('/stats/page-cache')
+def page_cache_stats():
+    # hits, misses and size of the rendered pages cache
+    return jsonify(page_cache.stats())
+
+
+@pages.route('/metrics')
+def metrics_page():
+    # prometheus text format, see modules/metrics.py
+    return metrics.metrics_response()
+
+
+@pages.cli.command('init-db')
+def init_db_command():
+    # create the database or apply its new migrations: flask --app server init-db
+    done = db_session.apply_migrations()
+    print(f'{len(done)} migrations applied' if done else 'database is up to date')
+
 
+@pages.cli.command('backfill-images')
+def backfill_images():
+    # make downsized copies for images that were uploaded before copies were made: flask --app server backfill-images
+    for folder in ('img/news', 'img/users', BLOB_FOLDER):
+        count = backfill_variants(os.path.join(current_app.static_folder, folder))
+        print(f'{folder}: {count} images processed')
+
+
+@pages.cli.command('recount-comments')
+def recount_comments_command():
+    # repair comment_count and last_comment_at of all news: flask --app server recount-comments
+    db_sess = db_session.create_session()
+    recount_comments(db_sess)
+    print('comment stats of all news are counted again')
+
+
+@pages.cli.command('check-query-plans')
+def check_query_plans_command():
+    # fails if main queries read whole tables: flask --app server check-query-plans
+    from modules.query_plans import check_query_plans
+
+    failed = []
+    for name, (plan, bad_lines) in check_query_plans().items():
+        print(f'{"FAIL" if bad_lines else "ok"}: {name}\n    ' + '\n    '.join(plan))
+        if bad_lines:
+            failed.append(name)
+    if failed:
+        raise click.ClickException(f'no index is used by: {", ".join(failed)}')
+
+
+@pages.app_errorhandler(400)
+def bad_request(error):
+    return make_response(jsonify({'error': 'Bad request'}), 400)
+
+
+@pages.app_errorhandler(413)
+def request_too_large(error):
+    return make_response(jsonify({'error': f'Request is too large, max size is '
+                                           f'{current_app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)} MB'}), 413)
+
+
+def main():
+    # development server, one process (see wsgi.py for several workers)
+    app = create_app()
+    db_session.check_schema()
     app.run(port=5000, host='127.0.0.1')
 
 
@@ -21,5 +21,8 @@ fi
 # Install the requirements
 $VIRTUALENV/bin/pip install -r requirements.txt
 
+# Create the database or apply its new migrations
+$VIRTUALENV/bin/flask --app server init-db
+
 # Run your glorious application
 $VIRTUALENV/bin/python3 server.py
\ No newline at end of file
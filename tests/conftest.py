@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+import sqlalchemy as sa
+
+PROJECT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_FOLDER)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # database is initialized once per process (see db_session.global_init), so all tests share it
+    from server import create_app
+
+    return create_app({'DB_FILE': str(tmp_path_factory.mktemp('db') / 'test.db'), 'DB_MIGRATE': True,
+                       'WTF_CSRF_ENABLED': False, 'PAGE_CACHE_SIZE': 0})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def statements():
+    # sql statements of all engines made while the test runs
+    counter = {'count': 0}
+
+    def count(*args):
+        counter['count'] += 1
+
+    sa.event.listen(sa.engine.Engine, 'before_cursor_execute', count)
+    yield counter
+    sa.event.remove(sa.engine.Engine, 'before_cursor_execute', count)
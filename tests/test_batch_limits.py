@@ -0,0 +1,9 @@
+from modules.batch import MAX_USER_BATCH_SIZE
+
+
+def test_user_batch_is_limited(client):
+    users = [{'nickname': 'user', 'email': f'batch{i}@example.com', 'password': 'password'}
+             for i in range(MAX_USER_BATCH_SIZE + 1)]
+    response = client.post('/api/users/batch', json={'users': users})
+    assert response.status_code == 400
+    assert f'max is {MAX_USER_BATCH_SIZE}' in response.json['message']
@@ -0,0 +1,31 @@
+import threading
+import time
+
+from modules import db_session
+from modules.blob import Blob, add_ref
+
+
+def test_same_image_added_by_two_sessions(app):
+    # both sessions don't see the blob yet, the second one waits for the write lock of the first
+    blob_id = '0' * 64 + '.png'
+    first, second = db_session.create_session(), db_session.create_session()
+    assert add_ref(first, blob_id, 10)
+    first.flush()
+
+    result = {}
+
+    def add_second():
+        result['new'] = add_ref(second, blob_id, 10)
+        second.commit()
+
+    thread = threading.Thread(target=add_second)
+    thread.start()
+    time.sleep(0.3)
+    first.commit()
+    thread.join()
+
+    assert result['new'] is False
+    session = db_session.create_session()
+    assert session.get(Blob, blob_id).ref_count == 2
+    for i in (first, second, session):
+        i.close()
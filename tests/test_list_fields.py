@@ -0,0 +1,8 @@
+def test_fields_are_normalized(client):
+    # repeats and order of fields don't make other answers (and other cached plans of Schema)
+    first = client.get('/api/users?fields=nickname,id,id')
+    assert first.status_code == 200
+    first_data = first.get_data()
+    second = client.get('/api/users?fields=id,nickname')
+    assert second.status_code == 200
+    assert first_data == second.get_data()
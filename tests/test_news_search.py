@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.mark.parametrize('query', ['limit=-1', 'limit=0', 'limit=1001', 'limit=abc', 'offset=-1', 'offset=abc'])
+def test_wrong_limit_and_offset_of_search(client, query):
+    assert client.get(f'/api/news?q=word&{query}').status_code == 400
+
+
+def test_search_with_limit_and_offset(client):
+    response = client.get('/api/news?q=word&limit=10&offset=5')
+    assert response.status_code == 200
+    assert response.get_json() == {'news': []}
@@ -0,0 +1,34 @@
+import pytest
+
+from modules import db_session
+from modules.comment import Comment, update_comment_stats
+from modules.news import News
+from modules.user import User
+
+
+def make_news(comments):
+    # news with comments of different users, returns news id
+    session = db_session.create_session()
+    users = [User(nickname=f'user {i}') for i in range(max(comments, 1))]
+    session.add_all(users)
+    session.flush()
+    news = News(title='news', about='about', tags='', creator_id=users[0].id)
+    session.add(news)
+    session.flush()
+    session.add_all(Comment(text=f'comment {i}', creator_id=users[i].id, news_id=news.id) for i in range(comments))
+    update_comment_stats(session, [news.id])
+    session.commit()
+    news_id = news.id
+    session.close()
+    return news_id
+
+
+@pytest.mark.parametrize('comments', [0, 30])
+def test_news_page_queries_dont_grow_with_comments(app, client, statements, comments):
+    news_id = make_news(comments)
+    statements['count'] = 0
+    response = client.get(f'/news/{news_id}')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('comment ') >= comments
+    # news with its creator, then comments with their creators
+    assert statements['count'] == 2
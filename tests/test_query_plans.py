@@ -0,0 +1,15 @@
+import pytest
+
+from modules.query_plans import QUERIES, check_query_plans
+
+
+@pytest.fixture(scope='module')
+def plans():
+    return check_query_plans()
+
+
+@pytest.mark.parametrize('name', list(QUERIES))
+def test_query_uses_indexes(plans, name):
+    plan, bad_lines = plans[name]
+    # the plan is in the message, so a missing index is easy to see
+    assert bad_lines == [], '\n'.join(plan)
@@ -0,0 +1,18 @@
+"""WSGI entry point for running the server with several worker processes:
+    flask --app server init-db
+    gunicorn -w 4 -b 127.0.0.1:5000 wsgi:app
+
+With --preload the app is made once before workers are forked, database pools are made again
+in every worker. Without it every worker makes its own app, with DB_MIGRATE=1 only one of them
+applies migrations (see migrations.migration_lock).
+Every worker has its own page cache, so cached pages are checked against table versions
+(PAGE_CACHE_CHECK_VERSIONS), and its own counters of /metrics.
+"""
+import os
+
+from modules import db_session
+from server import create_app
+
+app = create_app({'PAGE_CACHE_CHECK_VERSIONS': os.getenv('PAGE_CACHE_CHECK_VERSIONS', '1') == '1'})
+# schema is changed by "flask --app server init-db" before workers start
+db_session.check_schema()